@@ -0,0 +1,48 @@
+'''time the map generators and the cost of per-call vs pre-drawn random numbers'''
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+from generators import GENERATORS
+from random_streams import random_steps
+
+
+
+def per_call_steps(rng, p, size):
+    '''random steps drawn one `choice` call at a time, like the generators used to do'''
+    return [rng.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0] for _ in range(size)]
+
+
+def measure(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[300, 1000, 3000])
+    parser.add_argument('--generators', nargs='+', default=['layered', 'spiral'], choices=list(GENERATORS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # random number draws
+    rng = np.random.default_rng(args.seed)
+    draws = 100_000
+    per_call = measure(per_call_steps, rng, 0.15, draws)
+    pre_drawn = measure(random_steps, rng, 0.15, draws)
+    print(f'{draws} random steps: per call {per_call:.3f}s, pre-drawn {pre_drawn:.4f}s ({per_call/pre_drawn:.0f}x)')
+
+    # generators
+    with tempfile.TemporaryDirectory() as tmp:
+        for generator in args.generators:
+            for basesize in args.sizes:
+                duration = measure(GENERATORS[generator], filename=str(Path(tmp) / 'bench.map'), basesize=basesize, seed=args.seed)
+                print(f'{generator:>8} basesize {basesize:5d}: {duration:7.2f}s')
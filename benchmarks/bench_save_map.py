@@ -0,0 +1,85 @@
+'''compare the streaming map serializer with the old bytes concatenating one'''
+
+import io
+import sys
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+from map_creator import Item, toByte, write_map
+
+
+
+def legacy_map_bytes(items, data):
+    '''the old `save_map` serializer, building the file with repeated `bytes` concatenation'''
+    compressed_data = [zlib.compress(x) for x in data]
+    itemtypes = []
+    items_considered_so_far = 0
+    itemtypes_dict = defaultdict(lambda:0)
+    for item in items:
+        itemtypes_dict[item.type] += 1
+    for i, count in sorted(itemtypes_dict.items()):
+        itemtypes.append((i, items_considered_so_far, count))
+        items_considered_so_far += count
+    item_area_size = sum(len(x) for x in items)
+    data_area_size = sum(len(x) for x in compressed_data)
+    swaplen =  36 - 16 + 12*len(itemtypes) + 4*len(items) + 2*4*len(data) + item_area_size
+    size = swaplen + data_area_size
+    header = [4, size, swaplen, len(itemtypes), len(items), len(data), item_area_size, data_area_size]
+    result = b'DATA'
+    for x in header:
+        result += toByte(x)
+    for x in itemtypes:
+        for y in x:
+            result += toByte(y)
+    curr_offset = 0
+    for x in items:
+        result += toByte(curr_offset)
+        curr_offset += len(x)
+    curr_offset = 0
+    for x in compressed_data:
+        result += toByte(curr_offset)
+        curr_offset += len(x)
+    for x in data:
+        result += toByte(len(x))
+    for item in items:
+        result += b''.join([toByte((item.type << 16) + item.id), toByte(len(item.data) * 4)] + [toByte(x) for x in item.data])
+    for x in compressed_data:
+        result += x
+    return result
+
+
+def streaming_map_bytes(items, data):
+    f = io.BytesIO()
+    write_map(f, items, data, dedup=False, cache=None)  # the legacy serializer neither merges nor caches blocks
+    return f.getvalue()
+
+
+def example(num_items):
+    '''a map with `num_items` layer items and one small data block per layer'''
+    items = [Item(0, 0, [1]), Item(0, 1, [1] + [0xffffffff]*5)]
+    items += [Item(i, 5, [0, 2, 0, 3, 16, 16, 0, 255, 255, 255, 255, 0xffffffff, 0, 0xffffffff, i] + [0x80808080]*3 + [0xffffffff]*5) for i in range(num_items)]
+    data = [bytes([i % 256]) * 1024 for i in range(num_items)]
+    return items, data
+
+
+def measure(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+
+if __name__ == "__main__":
+    print(f'{"items":>8} {"legacy":>10} {"streaming":>10} {"speedup":>8}')
+    for num_items in [10, 100, 1000, 5000, 20000]:
+        items, data = example(num_items)
+        assert legacy_map_bytes(items, data) == streaming_map_bytes(items, data), 'output differs'
+        legacy = measure(legacy_map_bytes, items, data)
+        streaming = measure(streaming_map_bytes, items, data)
+        print(f'{num_items:8d} {legacy:9.4f}s {streaming:9.4f}s {legacy/streaming:7.1f}x')
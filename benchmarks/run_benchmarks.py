@@ -0,0 +1,123 @@
+'''benchmark map generation, serialization and reading with fixed seeds, save results as json and compare runs'''
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import generators
+from map_creator import create_map, compression_cache
+from map_reader import MapFile, TilemapLayerItem
+
+
+
+def generate(generator, params, seed):
+    '''run a generator without saving and return the game and tile layers it would save'''
+    captured = {}
+    def capture(game, tile_layers=[], filename=None, **kwargs):
+        captured.update(game=game, tile_layers=tile_layers)
+    func = generators.GENERATORS[generator]
+    with mock.patch.object(sys.modules[func.__module__], 'create_map', capture):
+        func(filename=None, seed=seed, **params)
+    return captured['game'], captured['tile_layers']
+
+
+def read(filename):
+    '''open a map, decompress all data and get all tilemaps'''
+    with MapFile(filename) as m:
+        data = list(m.data)
+        tilemaps = [m.get_tilemap(x) for x in m.items_of_type(TilemapLayerItem)]
+        del data, tilemaps
+
+
+def measure(func, *args, repeat=1, setup=None):
+    '''return the best time of `repeat` runs and the peak traced memory of one extra run, plus the result
+
+    `setup` is called (untimed) before each run, e.g. to clear caches so every run starts cold
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def run(generators_, sizes, seeds, repeat):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = str(Path(tmp) / 'bench.map')
+        for generator in generators_:
+            for basesize in sizes:
+                for seed in seeds:
+                    params = {} if generator == 'random_blocks' else {'basesize': basesize}
+                    stages = {}
+                    stages['generate'] = measure(generate, generator, params, seed, repeat=repeat)
+                    game, tile_layers = stages['generate'][2]
+                    # without compressed blocks of the previous run in the process wide cache
+                    stages['serialize'] = measure(create_map, game, tile_layers, filename, repeat=repeat, setup=compression_cache.clear)
+                    stages['read'] = measure(read, filename, repeat=repeat)
+                    size = Path(filename).stat().st_size
+                    for stage, (duration, peak, _) in stages.items():
+                        results.append({'generator': generator, 'basesize': basesize, 'seed': seed, 'stage': stage, 'time': duration, 'peak_memory': peak, 'map_size': size})
+                        print(f'{generator:>13} {basesize:5d} seed {seed:3d} {stage:>9}: {duration:8.3f}s {peak/2**20:9.1f} MiB')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''print time and memory ratios against a baseline run, return the number of regressions above `tolerance`'''
+    key = lambda x: (x['generator'], x['basesize'], x['seed'], x['stage'])
+    old = {key(x): x for x in baseline['results']}
+    regressions = 0
+    print('\ncompared to baseline:')
+    for x in results:
+        if key(x) not in old:
+            continue
+        time_ratio = x['time'] / max(old[key(x)]['time'], 1e-9)
+        memory_ratio = x['peak_memory'] / max(old[key(x)]['peak_memory'], 1)
+        regressed = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        regressions += regressed
+        print(f'{x["generator"]:>13} {x["basesize"]:5d} seed {x["seed"]:3d} {x["stage"]:>9}: time {time_ratio:5.2f}x, memory {memory_ratio:5.2f}x{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--generators', nargs='+', default=['layered', 'spiral'], choices=list(generators.GENERATORS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 300, 1000, 3000, 5000], help='basesizes to benchmark')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best time is reported')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='where to save the results')
+    parser.add_argument('--compare', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown / memory growth before a result counts as regression')
+    args = parser.parse_args()
+
+    results = run(args.generators, args.sizes, args.seeds, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor()},
+            'args': vars(args),
+            'results': results,
+        }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
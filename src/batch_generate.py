@@ -0,0 +1,112 @@
+'''generate many maps with one seed per map, spread across a process pool'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from generators import GENERATORS, generate, generate_valid
+from map_cache import MapCache
+from profiling import profiler
+
+
+
+def parse_param(text):
+    '''parse a `name=value` parameter, values are read as json if possible (numbers, lists, ...)'''
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'parameter {text!r} has to look like name=value')
+    try:
+        return name, json.loads(value)
+    except json.JSONDecodeError:
+        return name, value
+
+
+def generate_one(task):
+    '''generate one map in a worker process and return its manifest entry'''
+    index, generator, params, seed, filename, profile, attempts, cache = task
+    profiler.reset()
+    profiler.enabled = profile
+    start = time.perf_counter()
+    entry = {'index': index, 'generator': generator, 'seed': seed, 'params': params, 'filename': filename}
+    if cache:
+        cache = MapCache(*cache)
+        data, info = cache.generate(generator, seed, attempts, **params)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        entry['cached'] = cache.hits > 0
+        if attempts:
+            entry['map_seed'], entry['attempts'] = info['seed'], info['attempts']
+    elif attempts:
+        entry['map_seed'], entry['attempts'] = generate_valid(generator, filename, seed, attempts, **params)
+    else:
+        generate(generator, filename, seed, **params)
+    entry.update(time=time.perf_counter() - start, size=os.path.getsize(filename))
+    if profile:
+        entry['profile'] = profiler.report()
+    return entry
+
+
+def batch_generate(generator, count, first_seed=0, params={}, template='{generator}_{seed}.map', workers=None, manifest=None, profile=None, attempts=0, cache=None, cache_size=1024**3):
+    '''generate `count` maps with the seeds `first_seed`, `first_seed + 1`, ... and return the manifest entries
+
+    `template` is formatted with `generator`, `index` and `seed` to get the filename of each map.
+    if `profile` is given, stage timings and counters of each map are added to the manifest and their sum is saved to `profile`.
+    if `attempts` is given, candidates that can't be finished are dropped and regenerated up to `attempts` times per map,
+    the seed of the saved map is added to the manifest as `map_seed`.
+    if `cache` (a directory) is given, maps are copied from the `MapCache` there if they were generated before
+    '''
+    if generator not in GENERATORS:
+        raise ValueError(f'unknown generator {generator!r}, choose one of: {", ".join(GENERATORS)}')
+    tasks = []
+    for index in range(count):
+        seed = first_seed + index
+        filename = template.format(generator=generator, index=index, seed=seed)
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        tasks.append((index, generator, params, seed, filename, profile is not None, attempts, cache and (cache, cache_size)))
+
+    # generate maps, a few tasks per worker roundtrip to keep the pool busy
+    start = time.perf_counter()
+    workers = workers or os.cpu_count()
+    entries = []
+    with ProcessPoolExecutor(workers) as executor:
+        for entry in executor.map(generate_one, tasks, chunksize=max(1, count // (workers * 8))):
+            print(f'{entry["filename"]}: {entry["time"]:.2f}s, {entry["size"]} bytes')
+            entries.append(entry)
+    duration = time.perf_counter() - start
+    if profile:
+        profiler.reset()
+        for entry in entries:
+            profiler.merge(entry['profile'])
+        profiler.save(profile)
+    print(f'generated {count} maps in {duration:.2f}s ({count/duration:.2f} maps/s on {workers} workers)')
+
+    # save manifest
+    if manifest:
+        with open(manifest, 'w') as f:
+            json.dump({'generator': generator, 'params': params, 'workers': workers, 'time': duration, 'maps': entries}, f, indent=2)
+    return entries
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='generate many maps, each with its own seed')
+    parser.add_argument('generator', choices=list(GENERATORS))
+    parser.add_argument('-n', '--count', type=int, default=10, help='number of maps to generate')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the first map, the following maps use the next seeds')
+    parser.add_argument('-p', '--param', type=parse_param, action='append', default=[], help='generator parameter as name=value, e.g. basesize=300')
+    parser.add_argument('-t', '--template', default='{generator}_{seed}.map', help='filename template with {generator}, {index} and {seed}')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    parser.add_argument('-m', '--manifest', default='manifest.json', help='where to save the manifest')
+    parser.add_argument('--profile', metavar='REPORT', help='save stage timings and counters summed over all maps as json to REPORT')
+    parser.add_argument('--valid', metavar='ATTEMPTS', type=int, nargs='?', const=100, default=0, help='only save maps whose finish can be reached, trying up to ATTEMPTS (default: 100) seeds per map')
+    parser.add_argument('--cache', metavar='DIR', help='reuse maps generated before with the same parameters and seed from DIR and add new ones')
+    parser.add_argument('--cache-size', type=int, default=1024, help='MiB of maps to keep in the cache')
+    args = parser.parse_args()
+    try:
+        batch_generate(args.generator, args.count, args.seed, dict(args.param), args.template, args.workers, args.manifest, args.profile, args.valid, args.cache, args.cache_size * 2**20)
+    except (ValueError, TypeError) as e:
+        print(f'error: {e}')
+        sys.exit(1)
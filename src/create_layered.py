@@ -1,6 +1,19 @@
+import hashlib
+import importlib
+import os
+import pickle
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
 import numpy as np
 from map_creator import create_map
-import sys
+from random_streams import random_steps
+from obstacles import grow_obstacles
+from tilesets import TILESETS, TileMapping, tile_layers
+from freeze import add_freeze
+from reachability import UnreachableError, passes, is_finishable
+from profiling import profiler, profile_to
+import argparse
 
 
 
@@ -14,6 +27,80 @@ class CycleArray:
         return 2*30  # some very high number
 
 
+@lru_cache(maxsize=None)
+def source_version(*modules):
+    '''hash of the source code of the modules named `modules`, changes whenever their code does'''
+    h = hashlib.sha256()
+    for name in modules:
+        h.update(Path(importlib.import_module(name).__file__).read_bytes())
+    return h.hexdigest()[:16]
+
+
+def layout_version():
+    '''hash of the code building the layout, so checkpoints saved by other versions of it are never restored'''
+    return source_version(__name__, 'random_streams', 'obstacles', 'freeze')
+
+
+class LayoutCache:
+    '''checkpoints of `create_layered` after each part of the way, keyed by code version, params, seed and the directions used so far
+
+    when only later directions change, the parts before them are restored instead of rebuilt.
+    the checkpoints of the last `max_layouts` layouts are kept in memory, and saved to `directory` if given.
+    saved checkpoints are deleted least recently used first once they take more than `max_bytes`
+    '''
+    def __init__(self, directory=None, max_layouts=8, max_bytes=256*1024*1024):
+        self.directory = Path(directory) if directory else None
+        self.max_layouts = max_layouts
+        self.max_bytes = max_bytes
+        self.layouts = OrderedDict()  # key -> list of checkpoints
+
+    def _path(self, key):
+        return self.directory / (hashlib.sha1(repr(key).encode()).hexdigest() + '.pickle')
+
+    def get(self, key):
+        '''return the (mutable) list of checkpoints for `key`, empty if there are none yet'''
+        if key not in self.layouts and self.directory and self._path(key).exists():
+            with open(self._path(key), 'rb') as f:
+                self.layouts[key] = pickle.load(f)
+            os.utime(self._path(key))  # recently used, evicted last
+        self.layouts[key] = self.layouts.pop(key, [])
+        while len(self.layouts) > self.max_layouts:
+            self.layouts.popitem(last=False)
+        return self.layouts[key]
+
+    def save(self, key):
+        '''save the checkpoints for `key` to `directory`, if given'''
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self._path(key), 'wb') as f:
+                pickle.dump(self.layouts[key], f)
+            self.evict()
+
+    def evict(self):
+        '''delete the least recently used saved checkpoints until they all fit into `max_bytes`'''
+        layouts = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                layouts.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in layouts)
+        for _, size, path in sorted(layouts):
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+
+# visual layers, generated from the game layer
+TILE_LAYERS = [
+    ('generic_unhookable', TileMapping(TILESETS['generic_unhookable'])),
+    ('desert_main', TileMapping(TILESETS['desert_main'])),
+]
+
+
 def create_layered(
         filename=None,
         # config
@@ -31,14 +118,21 @@ def create_layered(
         block_corner = 1,
         block_obstacle = 1,
         block_freeze = 9,
-        directions = None  # directions to build along
+        directions = None,  # directions to build along
+        seed = None,  # seed for the random number generator, random if None
+        checkpoints = None,  # LayoutCache to continue from earlier runs with the same beginning, only used with a seed
+        progress = None,  # called as progress(parts_done, game) after each part of the way, may raise to cancel
+        check_reachable = False  # raise UnreachableError as soon as a part or the finish is blocked
     ):
+    lap = profiler.laps()
+    rng = np.random.default_rng(seed)
     directions = directions or CycleArray([2]*(basesize//blocklen-2) + [3] + [0]*(basesize//blocklen-2) + [3])
 
     # create the map matrix
     # 0: nothing, 1: normal, 3: unhookable, 33: start, 34: finish, 192: spwan
     size = np.array([basesize]*2)
-    game = np.full((size[0],size[1],4), 1, dtype='B')
+    game = np.full((size[0],size[1]), 1, dtype='B')
+    freeze_sources = np.zeros((size[0],size[1]), dtype=bool)  # blocks to put freeze around
 
     # add content
     start_pos = np.array([blocklen,blocklen])
@@ -62,7 +156,32 @@ def create_layered(
     xb = max(p1[0],p2[0],p3[0],p4[0])
     ya = min(p1[1],p2[1],p3[1],p4[1])
     yb = max(p1[1],p2[1],p3[1],p4[1])
-    game[xa:xb,ya:yb,0] = 0
+    game[xa:xb,ya:yb] = 0
+    lap('setup')
+
+    # restore the parts of the way an earlier run of the same code built with the same params, seed and directions
+    # (the first part also depends on the last direction, which wraps around)
+    steps = None
+    if checkpoints is not None and seed is not None:
+        key = (layout_version(), basesize, blocklen, min_wall_thickness, max_wall_thickness, wall_thickness_change_probability, obstacle_growlen, obstacle_size,
+               obstacle_side_switch_probability, obstacle_direction_change_probability, obstacle_freeze_probability,
+               block_wall, block_corner, block_obstacle, block_freeze, seed, int(directions[-1]))
+        steps = checkpoints.get(key)
+        reused = 0
+        while reused < len(steps) and reused + 1 < len(directions) and steps[reused][0] == tuple(int(directions[j]) for j in range(reused + 2)):
+            reused += 1
+        changed = reused < len(steps)
+        del steps[reused:]
+        for used, (xa, xb, ya, yb), game_box, freeze_box, state in steps:
+            game[xa:xb,ya:yb] = game_box
+            freeze_sources[xa:xb,ya:yb] = freeze_box
+        if steps:
+            pos, newpos, direction_i, left_thickness, right_thickness, hellofromtheotherside, forward, left, right, next_dir, rng.bit_generator.state = steps[-1][-1]
+        profiler.count('segments_reused', reused)
+        lap('checkpoints')
+        if progress and steps:
+            progress(direction_i, game)
+    margin = blocklen//2 + max(min_wall_thickness, max_wall_thickness, 1) + 1  # how far walls and corners reach out of a part
 
     # place one part of the way at a time until the border is reached or no directions are given
     while 0 <= newpos[0]+blocklen <= size[0] and 0 <= newpos[1]+blocklen <= size[1] and direction_i + 1 < len(directions):
@@ -93,16 +212,23 @@ def create_layered(
         xb = max(p1[0],p2[0],p3[0],p4[0])
         ya = min(p1[1],p2[1],p3[1],p4[1])
         yb = max(p1[1],p2[1],p3[1],p4[1])
-        game[xa:xb,ya:yb,0] = 0
+        game[xa:xb,ya:yb] = 0
+        touched = [xa, xb, ya, yb]  # region written by this part
+        lap('clear')
 
         # calculate position
         pos_ = pos - forward * blocklen//2  # set pos further to make extension for corners possible
         newpos_ = newpos + forward * blocklen//2  # set newpos further to make extension for corners possible
         a = np.array([min(pos_[0], newpos_[0]),min(pos_[1], newpos_[1])])
         b = np.array([max(pos_[0], newpos_[0]),max(pos_[1], newpos_[1])]) + 1
+        touched = [min(touched[0], a[0]-margin), max(touched[1], b[0]+margin), min(touched[2], a[1]-margin), max(touched[3], b[1]+margin)]
 
         # create thick wall and add freeze
+        num_tiles = (b[0] - a[0]) * (b[1] - a[1])
+        left_changes = random_steps(rng, wall_thickness_change_probability, num_tiles)  # thickness changes for each tile
+        right_changes = random_steps(rng, wall_thickness_change_probability, num_tiles)
         i = 0
+        tiles_placed = 0
         for x in list(range(a[0], b[0], 1))[::forward[0] or 1]:
             for y in list(range(a[1], b[1], 1))[::forward[1] or 1]:
                 # set blocks
@@ -114,14 +240,13 @@ def create_layered(
                     xb = max(x_, x_ - left[0] * left_thickness)
                     ya = min(y_, y_ - left[1] * left_thickness)
                     yb = max(y_, y_ - left[1] * left_thickness)
-                    game[xa:xb+1,ya:yb+1,0] = block_wall  # left side
+                    game[xa:xb+1,ya:yb+1] = block_wall  # left side
                     tmpx = x_ - left[0] * left_thickness
                     tmpy = y_ - left[1] * left_thickness
-                    tmp = game[tmpx-1:tmpx+2,tmpy-1:tmpy+2]
-                    game[tmpx-1:tmpx+2,tmpy-1:tmpy+2] = np.where(tmp > 0, tmp, block_freeze)  # put left freeze around block, without overwriting
+                    freeze_sources[tmpx,tmpy] = True  # put left freeze around block later
+                    tiles_placed += left_thickness + 1
                     # set next thickness
-                    p = wall_thickness_change_probability
-                    left_thickness += np.random.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0]
+                    left_thickness += left_changes[i]
                     if left_thickness > max_wall_thickness: left_thickness = max_wall_thickness
                     elif left_thickness < min_wall_thickness: left_thickness = min_wall_thickness
                 # right side
@@ -132,68 +257,89 @@ def create_layered(
                     xb = max(x_, x_ - right[0] * right_thickness)
                     ya = min(y_, y_ - right[1] * right_thickness)
                     yb = max(y_, y_ - right[1] * right_thickness)
-                    game[xa:xb+1,ya:yb+1,0] = block_wall  # right side
+                    game[xa:xb+1,ya:yb+1] = block_wall  # right side
                     tmpx = x_ - right[0] * right_thickness
                     tmpy = y_ - right[1] * right_thickness
-                    tmp = game[tmpx-1:tmpx+2,tmpy-1:tmpy+2]
-                    game[tmpx-1:tmpx+2,tmpy-1:tmpy+2] = np.where(tmp > 0, tmp, block_freeze)  # put right freeze around block, without overwriting
+                    freeze_sources[tmpx,tmpy] = True  # put right freeze around block later
+                    tiles_placed += right_thickness + 1
                     # set next thickness
-                    p = wall_thickness_change_probability
-                    right_thickness += np.random.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0]
+                    right_thickness += right_changes[i]
                     if right_thickness > max_wall_thickness: right_thickness = max_wall_thickness
                     elif right_thickness < min_wall_thickness: right_thickness = min_wall_thickness
                 i += 1
+        lap('walls')
         # generate left corners
         if less_left_end:
             for i in range(1,left_thickness+1):
                 left_end_base = pos + forward * (left_end-blocklen//2) + left * blocklen//2
                 start = left_end_base - left * i
                 end = left_end_base - left * i + forward * (left_thickness-i)
-                game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1, 0] = block_corner  # corner
-                tmp = game[end[0]-1:end[0]+2,end[1]-1:end[1]+2]
-                game[end[0]-1:end[0]+2,end[1]-1:end[1]+2] = np.where(tmp > 0, tmp, 9)  # put left freeze around block, without overwriting
+                game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1] = block_corner  # corner
+                freeze_sources[end[0],end[1]] = True  # put left freeze around block later
         # generate right corners
         if less_right_end:
             for i in range(1,right_thickness+1):
                 right_end_base = pos + forward * (right_end-blocklen//2) + right * blocklen//2
                 start = right_end_base - right * i
                 end = right_end_base - right * i + forward * (right_thickness-i)
-                game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1, 0] = block_corner  # corner
-                tmp = game[end[0]-1:end[0]+2,end[1]-1:end[1]+2]
-                game[end[0]-1:end[0]+2,end[1]-1:end[1]+2] = np.where(tmp > 0, tmp, 9)  # put right freeze around block, without overwriting
+                game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1] = block_corner  # corner
+                freeze_sources[end[0],end[1]] = True  # put right freeze around block later
+        lap('corners')
 
         # create obstacle
         # TODO: allow obstacles in corners
-        putfreeze = np.random.choice([True, False], 1, p=[obstacle_freeze_probability,1-obstacle_freeze_probability])[0]
+        putfreeze = rng.random() < obstacle_freeze_probability
+        profiler.count('rng_draws')
         if not less_left_start and not less_right_start:  # dont create obstacles in corners
             # grow multiple obstacles at the same place to increase size
-            for _ in range(obstacle_size):
-                # set start position and grow direction
-                if hellofromtheotherside:  # right
-                    grow_direction = directions[direction_i] + 1
-                    o_pos = pos - right * blocklen//2
-                else:  # left
-                    grow_direction = directions[direction_i] + 3
-                    o_pos = pos - left * blocklen//2
-                start = o_pos.copy()
-                initial_grow_dir = rotations[grow_direction]
-                o_pos += rotations[grow_direction]
-                # grow obstacle
-                while sum((o_pos-start)**2) < obstacle_growlen**2 and ((o_pos-start+rotations[grow_direction]) * initial_grow_dir >= 0).all():  # stop when going too far or when hitting a wall
-                    game[o_pos[0],o_pos[1],0] = block_obstacle  # grow obstacle block
-                    if putfreeze:
-                        tmp = game[o_pos[0]-1:o_pos[0]+2,o_pos[1]-1:o_pos[1]+2]
-                        game[o_pos[0]-1:o_pos[0]+2,o_pos[1]-1:o_pos[1]+2] = np.where(tmp > 0, tmp, block_freeze)  # put freeze around block, without overwriting
-                    grow_direction += np.random.choice([-1,0,1], 1, p=[obstacle_direction_change_probability/2,1-obstacle_direction_change_probability,obstacle_direction_change_probability/2])[0]  # select random new grow direction
-                    o_pos += rotations[grow_direction]
+            if hellofromtheotherside:  # right
+                grow_direction = directions[direction_i] + 1
+                o_pos = pos - right * blocklen//2
+            else:  # left
+                grow_direction = directions[direction_i] + 3
+                o_pos = pos - left * blocklen//2
+            tiles = grow_obstacles(rng, o_pos, grow_direction, obstacle_growlen, obstacle_size, obstacle_direction_change_probability)
+            game[tiles[:,0],tiles[:,1]] = block_obstacle  # grow obstacle blocks
+            if putfreeze:
+                freeze_sources[tiles[:,0],tiles[:,1]] = True  # put freeze around blocks later
+            tiles_placed += len(tiles)
+            if len(tiles):
+                touched = [min(touched[0], tiles[:,0].min()), max(touched[1], tiles[:,0].max()+1), min(touched[2], tiles[:,1].min()), max(touched[3], tiles[:,1].max()+1)]
             # randomly switch side
-            hellofromtheotherside ^= np.random.choice([True, False], 1, p=[obstacle_side_switch_probability,1-obstacle_side_switch_probability])[0]
+            hellofromtheotherside ^= rng.random() < obstacle_side_switch_probability
+            profiler.count('rng_draws')
+        lap('obstacles')
+        profiler.count('segments')
+        profiler.count('tiles_placed', tiles_placed)
+
+        # give up early if walls or obstacles block this part (obstacles grow at its start, so check from the start of the last part)
+        if check_reachable:
+            last_pos = pos - rotations[directions[direction_i - 1]] * blocklen if direction_i else pos
+            blocked = not passes(game, last_pos, newpos, blocklen//4, blocklen)
+            lap('reachability')
+            if blocked:
+                raise UnreachableError(f'part {direction_i} is blocked')
 
         # update variables for next run
         direction_i += 1
         pos = newpos
         newpos = pos + rotations[directions[direction_i]] * blocklen
 
+        # checkpoint the touched region and the state after this part
+        if steps is not None:
+            xa, xb, ya, yb = touched
+            if xa < 0 or ya < 0 or xb > size[0] or yb > size[1]:
+                xa, xb, ya, yb = 0, size[0], 0, size[1]  # negative indices wrap around, keep everything
+            used = tuple(int(directions[j]) for j in range(direction_i + 1))
+            state = (pos, newpos, direction_i, left_thickness, right_thickness, hellofromtheotherside, forward, left, right, next_dir, rng.bit_generator.state)
+            steps.append((used, (xa, xb, ya, yb), game[xa:xb,ya:yb].copy(), freeze_sources[xa:xb,ya:yb].copy(), state))
+            changed = True
+            lap('checkpoints')
+        if progress:
+            progress(direction_i, game)
+
+    if steps is not None and changed:
+        checkpoints.save(key)
 
     # fill hole created for next
     next_right = rotations[directions[direction_i] - 1]
@@ -206,55 +352,64 @@ def create_layered(
     xb = max(p1[0],p2[0],p3[0],p4[0])
     ya = min(p1[1],p2[1],p3[1],p4[1])
     yb = max(p1[1],p2[1],p3[1],p4[1])
-    game[xa:xb,ya:yb,0] = 1
+    game[xa:xb,ya:yb] = 1
+    lap('clear')
+
+    # put freeze around blocks, without overwriting
+    add_freeze(game, freeze_sources, block_freeze)
+    lap('freeze')
 
     # create spawn and start line
     a = start_pos - blocklen//2 + 1
     b = start_pos + blocklen//2
-    game[a[0]-1:b[0]+1,a[1]-1:b[1]+1,0] = 1  # add wall around spawn
-    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1,0] = 0  # remove stuff
+    game[a[0]-1:b[0]+1,a[1]-1:b[1]+1] = 1  # add wall around spawn
+    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1] = 0  # remove stuff
     a += rotations[directions[0]]
     b += rotations[directions[0]]
-    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1,0] = 0  # remove stuff
-    game[start_pos[0],start_pos[1],0] = 192  # create spawn
+    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1] = 0  # remove stuff
+    game[start_pos[0],start_pos[1]] = 192  # create spawn
     start_line_start = start_pos + rotations[directions[0]] * (blocklen // 2) - rotations[directions[0] + 1] * (blocklen // 2 - 2)
     start_line_end = start_line_start + rotations[directions[0] + 1] * (blocklen - 4)
     a = np.array([min(start_line_start[0], start_line_end[0]),min(start_line_start[1], start_line_end[1])])
     b = np.array([max(start_line_start[0], start_line_end[0]),max(start_line_start[1], start_line_end[1])]) + 1
-    game[a[0]:b[0],a[1]:b[1],0] = 33  # create start line
+    game[a[0]:b[0],a[1]:b[1]] = 33  # create start line
     tmp = start_pos + rotations[directions[0]] * blocklen//2
 
     # create finish line
     a = pos - blocklen//2 + 1
     b = pos + blocklen//2
-    game[a[0]-1:b[0]+1,a[1]-1:b[1]+1,0] = 1  # add wall around finish area
-    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1,0] = 0  # remove stuff
+    game[a[0]-1:b[0]+1,a[1]-1:b[1]+1] = 1  # add wall around finish area
+    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1] = 0  # remove stuff
     a -= forward
     b -= forward
-    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1,0] = 0  # remove stuff
+    game[a[0]+1:b[0]-1,a[1]+1:b[1]-1] = 0  # remove stuff
     start_line_start = pos - forward * blocklen//2 + left * (blocklen // 2 - 2)
     start_line_end = start_line_start + right * (blocklen - 4)
     a = np.array([min(start_line_start[0], start_line_end[0]),min(start_line_start[1], start_line_end[1])])
     b = np.array([max(start_line_start[0], start_line_end[0]),max(start_line_start[1], start_line_end[1])]) + 1
-    game[a[0]:b[0],a[1]:b[1],0] = 34  # create finish line
+    game[a[0]:b[0],a[1]:b[1]] = 34  # create finish line
+    lap('spawn_finish')
+
+    if check_reachable:
+        finishable = is_finishable(game)
+        lap('reachability')
+        if not finishable:
+            raise UnreachableError('the finish can\'t be reached from the spawn')
 
     # generate visual tile layers
-    layer_unhookable = np.zeros(game.shape, dtype='B')
-    layer_unhookable[:,:,0] = np.array(np.where(game[:,:,0] == 3, 8, 0), dtype='B')  # walls
-    layer_desert = np.zeros(game.shape, dtype='B')
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 1, np.random.choice(np.array([7,64,65,70], dtype='B'), game[:,:,0].shape), 0), dtype='B')  # obstacles
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 9, 126, 0), dtype='B')  # freeze
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 33, 94, 0), dtype='B')  # start line
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 34, 94, 0), dtype='B')  # finish line
+    layers = tile_layers(game, TILE_LAYERS, rng)
+    lap('visual_layers')
 
     # generate the map file
-    create_map(game, [('generic_unhookable', layer_unhookable), ('desert_main', layer_desert)], filename=filename)
+    create_map(game, layers, filename=filename)
 
 
 
 # generate a map when the script is called from the command line
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        create_layered(filename=sys.argv[1])
-    else:
-        create_layered()
+    parser = argparse.ArgumentParser(description='create a layered map')
+    parser.add_argument('filename', nargs='?', default=None, help='map file to write (default: newmap.map), - for stdout')
+    parser.add_argument('--profile', metavar='REPORT', help='save stage timings and counters as json to REPORT')
+    args = parser.parse_args()
+    with profile_to(args.profile):
+        create_layered(filename=args.filename)
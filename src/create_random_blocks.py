@@ -1,28 +1,30 @@
 import numpy as np
 from map_creator import create_map
-import sys
+from profiling import profile_to
+import argparse
 
 
 
-def create_random_blocks(filename=None):
+def create_random_blocks(filename=None, seed=None):
     '''crea a map with just some manually placed blocks'''
+    rng = np.random.default_rng(seed)
 
     # create the map matrix
-    game = np.zeros((50,50,4), dtype='B')
-    tiles = np.zeros((50,50,4), dtype='B')
+    game = np.zeros((50,50), dtype='B')
+    tiles = np.zeros((50,50), dtype='B')
 
     # add content
-    game[0,:,0] = 1  # top wall
-    game[-1,:,0] = 1  # ground wall
-    game[:,0,0] = 1  # left wall
-    game[:,-1,0] = 1  # right wall
-    game[-2,24,0] = 192  # spawn
-    game[5:-5,5:-5,0] = np.random.rand(40,40) > 0.95  # random blocks
-    tiles[0,:,0] = 1  # top wall
-    tiles[-1,:,0] = 1  # ground wall
-    tiles[:,0,0] = 1  # left wall
-    tiles[:,-1,0] = 1  # right wall
-    tiles[5:-5,5:-5,0] = game[5:-5,5:-5,0] * 16
+    game[0,:] = 1  # top wall
+    game[-1,:] = 1  # ground wall
+    game[:,0] = 1  # left wall
+    game[:,-1] = 1  # right wall
+    game[-2,24] = 192  # spawn
+    game[5:-5,5:-5] = rng.random((40,40)) > 0.95  # random blocks
+    tiles[0,:] = 1  # top wall
+    tiles[-1,:] = 1  # ground wall
+    tiles[:,0] = 1  # left wall
+    tiles[:,-1] = 1  # right wall
+    tiles[5:-5,5:-5] = game[5:-5,5:-5] * 16
 
     # generate the map file
     create_map(game, [('grass_main', tiles)], filename=filename)
@@ -31,7 +33,9 @@ def create_random_blocks(filename=None):
 
 # generate a map when the script is called from the command line
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        create_random_blocks(filename=sys.argv[1])
-    else:
-        create_random_blocks()
+    parser = argparse.ArgumentParser(description='create a map with some random blocks')
+    parser.add_argument('filename', nargs='?', default=None, help='map file to write (default: newmap.map), - for stdout')
+    parser.add_argument('--profile', metavar='REPORT', help='save stage timings and counters as json to REPORT')
+    args = parser.parse_args()
+    with profile_to(args.profile):
+        create_random_blocks(filename=args.filename)
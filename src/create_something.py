@@ -1,5 +1,5 @@
 '''manually create a layered map'''
-from create_layered import create_layered
+from create_layered import create_layered, LayoutCache
 
 
 
@@ -8,7 +8,7 @@ create_layered(
     # config
     basesize = 300,
     blocklen = 20,
-    growlen = 11,  # has be be less than sqrt(0.5) * blocklen - 2
+    obstacle_growlen = 11,  # has be be less than sqrt(0.5) * blocklen - 2
     min_wall_thickness = 1,  # on each side
     max_wall_thickness = 5 , # on each side
     wall_thickness_change_probability = 0.15,
@@ -20,5 +20,7 @@ create_layered(
     block_corner = 1,
     block_obstacle = 1,
     block_freeze = 9,
-    directions = [2,2,2,3,3,3,2,1,1,1,2,2,3,3,3,2,1,1,1,2,2,2,2]  # directions to build along
+    directions = [2,2,2,3,3,3,2,1,1,1,2,2,3,3,3,2,1,1,1,2,2,2,2],  # directions to build along
+    seed = 0,
+    checkpoints = LayoutCache('.layout_cache')  # rerunning after changing a direction only rebuilds the parts after it
 )
@@ -2,7 +2,13 @@
 
 import numpy as np
 from map_creator import create_map
-import sys
+from random_streams import random_steps
+from obstacles import grow_obstacles
+from tilesets import TILESETS, TileMapping, tile_layers
+from freeze import add_freeze
+from reachability import UnreachableError, passes, is_finishable
+from profiling import profiler, profile_to
+import argparse
 
 
 
@@ -16,22 +22,49 @@ class CycleArray:
         return len(self.arr)
 
 
-def create_spiral(filename=None):
-    # config
-    basesize = 200
-    blocklen = 20
-    min_wall_thickness = 1  # on each side
-    max_wall_thickness = 4  # on each side
-    wall_thickness_change_probability = 0.15
-    obstacle_size = 5
-    obstacle_side_switch_probability = 0.8
-    obstacle_direction_change_probability = 0.4
-    obstacle_freeze_probability = 0.5
+# visual layers, generated from the game layer
+TILE_LAYERS = [
+    ('generic_unhookable', TileMapping(TILESETS['generic_unhookable'])),
+    ('desert_main', TileMapping({**TILESETS['desert_main'], 1: [7, 64, 65]})),
+]
+
+
+def check_segment(game, pos, newpos, currdir, nextdir, blocklen):
+    '''raise UnreachableError if the corridor along the inner side of the wall from `pos` to `newpos` is blocked
+
+    the corridor between a wall and the round inside it is complete once the wall is built (obstacles of the
+    wall itself only grow into the corridor outside it), it is checked from corner to corner
+    '''
+    half = blocklen // 2
+    start = pos + (np.array(nextdir) + currdir) * half
+    end = newpos + (np.array(nextdir) - currdir) * half
+    if not passes(game, start, end, blocklen//4, blocklen):
+        raise UnreachableError(f'the corridor from {tuple(pos)} to {tuple(newpos)} is blocked')
+
+
+def create_spiral(
+        filename=None,
+        # config
+        basesize = 200,
+        blocklen = 20,
+        min_wall_thickness = 1,  # on each side
+        max_wall_thickness = 4,  # on each side
+        wall_thickness_change_probability = 0.15,
+        obstacle_size = 5,
+        obstacle_side_switch_probability = 0.8,
+        obstacle_direction_change_probability = 0.4,
+        obstacle_freeze_probability = 0.5,
+        seed = None,  # seed for the random number generator, random if None
+        check_reachable = False  # raise UnreachableError as soon as a segment or the finish is blocked
+    ):
+    lap = profiler.laps()
+    rng = np.random.default_rng(seed)
 
     # create the map matrix
     # 0: nothing, 1: normal, 3: unhookable, 33: start, 34: finish, 192: spwan
     size = np.array([basesize]*2)
-    game = np.zeros((size[0],size[1],4), dtype='B')
+    game = np.zeros((size[0],size[1]), dtype='B')
+    freeze_sources = np.zeros((size[0],size[1]), dtype=bool)  # blocks to put freeze around
 
     # add content
     sidelen = 1
@@ -43,6 +76,7 @@ def create_spiral(filename=None):
     hellofromtheotherside = False  # side to grow obstacles from
     inner_thickness = 1
     outer_thickness = 1
+    lap('setup')
     while 0 <= newpos[0]+blocklen*2 <= size[0] and 0 <= newpos[1]+blocklen*2 <= size[1]:
         # directions
         currdir = directions[direction]
@@ -53,9 +87,13 @@ def create_spiral(filename=None):
         b = np.array([max(pos[0], newpos[0]),max(pos[1], newpos[1])]) + 1
 
         # create wall
-        game[a[0]:b[0],a[1]:b[1],0] = 1
+        game[a[0]:b[0],a[1]:b[1]] = 1
 
         # make wall thick and add freeze
+        num_tiles = (b[0] - a[0]) * (b[1] - a[1])
+        inner_changes = iter(random_steps(rng, wall_thickness_change_probability, num_tiles))  # thickness changes for each tile
+        outer_changes = iter(random_steps(rng, wall_thickness_change_probability, num_tiles))
+        tiles_placed = 0
         for x in list(range(a[0], b[0], 1))[::currdir[0] or 1]:
             for y in list(range(a[1], b[1], 1))[::currdir[1] or 1]:
                 # set blocks
@@ -63,34 +101,33 @@ def create_spiral(filename=None):
                 xb = x + inner_thickness * (nextdir[0] if nextdir[0] > 0 else 0)
                 ya = y + inner_thickness * (nextdir[1] if nextdir[1] < 0 else 0)
                 yb = y + inner_thickness * (nextdir[1] if nextdir[1] > 0 else 0)
-                game[xa:xb+1,ya:yb+1,0] = 1  # inner
+                game[xa:xb+1,ya:yb+1] = 1  # inner
                 tmpx = x+inner_thickness*nextdir[0]
                 tmpy = y+inner_thickness*nextdir[1]
-                tmp = game[tmpx-1:tmpx+2,tmpy-1:tmpy+2]
-                game[tmpx-1:tmpx+2,tmpy-1:tmpy+2] = np.where(tmp > 0, tmp, 9)  # put inner freeze around block, without overwriting
+                freeze_sources[tmpx,tmpy] = True  # put inner freeze around block later
                 xa = x - outer_thickness * (nextdir[0] if nextdir[0] > 0 else 0)
                 xb = x - outer_thickness * (nextdir[0] if nextdir[0] < 0 else 0)
                 ya = y - outer_thickness * (nextdir[1] if nextdir[1] > 0 else 0)
                 yb = y - outer_thickness * (nextdir[1] if nextdir[1] < 0 else 0)
-                game[xa:xb+1,ya:yb+1,0] = 1  # outer
+                game[xa:xb+1,ya:yb+1] = 1  # outer
                 tmpx = x-outer_thickness*nextdir[0]
                 tmpy = y-outer_thickness*nextdir[1]
-                tmp = game[tmpx-1:tmpx+2,tmpy-1:tmpy+2]
-                game[tmpx-1:tmpx+2,tmpy-1:tmpy+2] = np.where(tmp > 0, tmp, 9)  # put outer freeze around block, without overwriting
+                freeze_sources[tmpx,tmpy] = True  # put outer freeze around block later
+                tiles_placed += inner_thickness + outer_thickness + 2
                 # set next thickness
-                p = wall_thickness_change_probability
-                inner_thickness += np.random.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0]
+                inner_thickness += next(inner_changes)
                 if inner_thickness > max_wall_thickness: inner_thickness = max_wall_thickness
                 elif inner_thickness < min_wall_thickness: inner_thickness = min_wall_thickness
-                outer_thickness += np.random.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0]
+                outer_thickness += next(outer_changes)
                 if outer_thickness > max_wall_thickness: outer_thickness = max_wall_thickness
                 elif outer_thickness < min_wall_thickness: outer_thickness = min_wall_thickness
+        lap('walls')
         for i in range(1,outer_thickness+1):
             start = newpos - nextdir * i
             end = newpos - nextdir * i + currdir * (outer_thickness-i)
-            game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1, 0] = 1  # outer corners
-            tmp = game[end[0]-1:end[0]+2,end[1]-1:end[1]+2]
-            game[end[0]-1:end[0]+2,end[1]-1:end[1]+2] = np.where(tmp > 0, tmp, 9)  # put outer freeze around block, without overwriting
+            game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1] = 1  # outer corners
+            freeze_sources[end[0],end[1]] = True  # put outer freeze around block later
+        lap('corners')
 
         # create obstacles
         growlen = int(blocklen*0.6)  # has be be less than sqrt(0.5) ~= 0,7
@@ -101,29 +138,29 @@ def create_spiral(filename=None):
                 if first:
                     first = False
                     continue
-                putfreeze = np.random.choice([True, False], 1, p=[obstacle_freeze_probability,1-obstacle_freeze_probability])[0]
+                putfreeze = rng.random() < obstacle_freeze_probability
+                profiler.count('rng_draws')
                 # grow multiple obstacles at the same place to increase size
-                for _ in range(obstacle_size):
-                    # set start position and grow direction
-                    if hellofromtheotherside:
-                        grow_direction = direction + 1
-                        pos = np.array([startx,starty]) - nextdir * blocklen
-                    else:
-                        grow_direction = direction + 3
-                        pos = np.array([startx,starty]).copy()
-                    start = pos.copy()
-                    initial_grow_dir = directions[grow_direction]
-                    pos += directions[grow_direction]
-                    # grow obstacle
-                    while sum((pos-start)**2) < growlen**2 and ((pos-start+directions[grow_direction]) * initial_grow_dir >= 0).all():  # stop when going too far or when hitting a wall
-                        game[pos[0],pos[1],0] = 1  # grow obstacle block
-                        if putfreeze:
-                            tmp = game[pos[0]-1:pos[0]+2,pos[1]-1:pos[1]+2]
-                            game[pos[0]-1:pos[0]+2,pos[1]-1:pos[1]+2] = np.where(tmp > 0, tmp, 9)  # put freeze around block, without overwriting
-                        grow_direction += np.random.choice([-1,0,1], 1, p=[obstacle_direction_change_probability/2,1-obstacle_direction_change_probability,obstacle_direction_change_probability/2])[0]  # select random new grow direction
-                        pos += directions[grow_direction]
+                if hellofromtheotherside:
+                    grow_direction = direction + 1
+                    o_pos = np.array([startx,starty]) - nextdir * blocklen
+                else:
+                    grow_direction = direction + 3
+                    o_pos = np.array([startx,starty])
+                tiles = grow_obstacles(rng, o_pos, grow_direction, growlen, obstacle_size, obstacle_direction_change_probability)
+                game[tiles[:,0],tiles[:,1]] = 1  # grow obstacle blocks
+                if putfreeze:
+                    freeze_sources[tiles[:,0],tiles[:,1]] = True  # put freeze around blocks later
+                tiles_placed += len(tiles)
                 # randomly switch side
-                hellofromtheotherside ^= np.random.choice([True, False], 1, p=[obstacle_side_switch_probability,1-obstacle_side_switch_probability])[0]
+                hellofromtheotherside ^= rng.random() < obstacle_side_switch_probability
+                profiler.count('rng_draws')
+        lap('obstacles')
+        profiler.count('segments')
+        profiler.count('tiles_placed', tiles_placed)
+        if check_reachable:
+            check_segment(game, pos, newpos, currdir, nextdir, blocklen)
+            lap('reachability')
 
         # update variables for next run
         direction = (direction + 1) % len(directions)  # % is only needed to keey the variable small for performance reasons
@@ -143,12 +180,17 @@ def create_spiral(filename=None):
         nextdir = directions[direction + 1]
         a_ = a + nextdir + np.absolute(currdir)
         b_ = b + nextdir - np.absolute(currdir)
-        game[a_[0]:b_[0],a_[1]:b_[1],0] = np.where(game[a_[0]:b_[0],a_[1]:b_[1],0] > 0, game[a_[0]:b_[0],a_[1]:b_[1],0], 9)  # inner freeze (dont overwrite obstacles)
+        game[a_[0]:b_[0],a_[1]:b_[1]] = np.where(game[a_[0]:b_[0],a_[1]:b_[1]] > 0, game[a_[0]:b_[0],a_[1]:b_[1]], 9)  # inner freeze (dont overwrite obstacles)
+        lap('freeze')
 
         # create wall
-        game[a[0]:b[0],a[1]:b[1],0] = 1
+        game[a[0]:b[0],a[1]:b[1]] = 1
 
         # make wall thick and add freeze
+        num_tiles = (b[0] - a[0]) * (b[1] - a[1])
+        inner_changes = iter(random_steps(rng, wall_thickness_change_probability, num_tiles))  # thickness changes for each tile
+        outer_changes = iter(random_steps(rng, wall_thickness_change_probability, num_tiles))
+        tiles_placed = 0
         for x in list(range(a[0], b[0], 1))[::currdir[0] or 1]:
             for y in list(range(a[1], b[1], 1))[::currdir[1] or 1]:
                 # set blocks
@@ -156,34 +198,38 @@ def create_spiral(filename=None):
                 xb = x + inner_thickness * (nextdir[0] if nextdir[0] > 0 else 0)
                 ya = y + inner_thickness * (nextdir[1] if nextdir[1] < 0 else 0)
                 yb = y + inner_thickness * (nextdir[1] if nextdir[1] > 0 else 0)
-                game[xa:xb+1,ya:yb+1,0] = 1  # inner
+                game[xa:xb+1,ya:yb+1] = 1  # inner
                 tmpx = x+inner_thickness*nextdir[0]
                 tmpy = y+inner_thickness*nextdir[1]
-                tmp = game[tmpx-1:tmpx+2,tmpy-1:tmpy+2]
-                game[tmpx-1:tmpx+2,tmpy-1:tmpy+2] = np.where(tmp > 0, tmp, 9)  # put inner freeze around block, without overwriting
+                freeze_sources[tmpx,tmpy] = True  # put inner freeze around block later
                 xa = x - outer_thickness * (nextdir[0] if nextdir[0] > 0 else 0)
                 xb = x - outer_thickness * (nextdir[0] if nextdir[0] < 0 else 0)
                 ya = y - outer_thickness * (nextdir[1] if nextdir[1] > 0 else 0)
                 yb = y - outer_thickness * (nextdir[1] if nextdir[1] < 0 else 0)
-                game[xa:xb+1,ya:yb+1,0] = 1  # outer
+                game[xa:xb+1,ya:yb+1] = 1  # outer
                 tmpx = x-outer_thickness*nextdir[0]
                 tmpy = y-outer_thickness*nextdir[1]
-                tmp = game[tmpx-1:tmpx+2,tmpy-1:tmpy+2]
-                game[tmpx-1:tmpx+2,tmpy-1:tmpy+2] = np.where(tmp > 0, tmp, 9)  # put outer freeze around block, without overwriting
+                freeze_sources[tmpx,tmpy] = True  # put outer freeze around block later
+                tiles_placed += inner_thickness + outer_thickness + 2
                 # set next thickness
-                p = wall_thickness_change_probability
-                inner_thickness += np.random.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0]
+                inner_thickness += next(inner_changes)
                 if inner_thickness > max_wall_thickness: inner_thickness = max_wall_thickness
                 elif inner_thickness < min_wall_thickness: inner_thickness = min_wall_thickness
-                outer_thickness += np.random.choice([-1,0,1], 1, p=[p/2,1-p,p/2])[0]
+                outer_thickness += next(outer_changes)
                 if outer_thickness > max_wall_thickness: outer_thickness = max_wall_thickness
                 elif outer_thickness < min_wall_thickness: outer_thickness = min_wall_thickness
+        lap('walls')
         for i in range(1,outer_thickness+1):
             start = newpos - nextdir * i
             end = newpos - nextdir * i + currdir * (outer_thickness-i)
-            game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1, 0] = 1  # outer corners
-            tmp = game[end[0]-1:end[0]+2,end[1]-1:end[1]+2]
-            game[end[0]-1:end[0]+2,end[1]-1:end[1]+2] = np.where(tmp > 0, tmp, 9)  # put outer freeze around block, without overwriting
+            game[min(start[0],end[0]):max(start[0],end[0])+1, min(start[1],end[1]):max(start[1],end[1])+1] = 1  # outer corners
+            freeze_sources[end[0],end[1]] = True  # put outer freeze around block later
+        lap('corners')
+        profiler.count('segments')
+        profiler.count('tiles_placed', tiles_placed)
+        if check_reachable:
+            check_segment(game, pos, newpos, currdir, nextdir, blocklen)
+            lap('reachability')
 
         # update variables for next run
         direction = (direction + 1) % len(directions)  # `%` is only needed to keep the variable small for performance reasons
@@ -192,45 +238,54 @@ def create_spiral(filename=None):
         pos = newpos
         newpos = pos + directions[direction] * sidelen * blocklen
 
+    # put freeze around blocks, without overwriting
+    add_freeze(game, freeze_sources)
+    lap('freeze')
+
     # create freeze free spawn with start
     mid = size//2-1
     a = mid - blocklen//2 + 1
     b = mid + blocklen//2
-    tmp = game[a[0]:b[0],a[1]:b[1],0]
-    game[a[0]:b[0],a[1]:b[1],0] = np.where(np.isin(tmp, [1,3]), tmp, 0)  # remove freeze
-    game[mid[0],mid[1],0] = 192  # create spawn
-    tmp = game[mid[0]-blocklen//2:mid[0]+blocklen//2+1,mid[1]+blocklen//2+1,0]
-    game[mid[0]-blocklen//2:mid[0]+blocklen//2+1,mid[1]+blocklen//2,0] = np.where(np.isin(tmp, [1,3]), tmp, 33)  # create start line without overwriting blocks
+    tmp = game[a[0]:b[0],a[1]:b[1]]
+    game[a[0]:b[0],a[1]:b[1]] = np.where(np.isin(tmp, [1,3]), tmp, 0)  # remove freeze
+    game[mid[0],mid[1]] = 192  # create spawn
+    tmp = game[mid[0]-blocklen//2:mid[0]+blocklen//2+1,mid[1]+blocklen//2+1]
+    game[mid[0]-blocklen//2:mid[0]+blocklen//2+1,mid[1]+blocklen//2] = np.where(np.isin(tmp, [1,3]), tmp, 33)  # create start line without overwriting blocks
     finish_line_start = pos - directions[direction-1]*blocklen
     finish_line_end = finish_line_start + directions[direction]*blocklen
     a = np.array([min(finish_line_start[0], finish_line_end[0]),min(finish_line_start[1], finish_line_end[1])])
     b = np.array([max(finish_line_start[0], finish_line_end[0]),max(finish_line_start[1], finish_line_end[1])]) + 1
-    tmp = game[a[0]:b[0],a[1]:b[1],0]
-    game[a[0]:b[0],a[1]:b[1],0] = np.where(np.isin(tmp, [1,3]), tmp, 34)  # create finish line without overwriting blocks
+    tmp = game[a[0]:b[0],a[1]:b[1]]
+    game[a[0]:b[0],a[1]:b[1]] = np.where(np.isin(tmp, [1,3]), tmp, 34)  # create finish line without overwriting blocks
 
     # generate outer walls/nothing
-    game[blocklen,:,0] = 0  # top wall
-    game[-blocklen-1,:,0] = 0  # ground wall
-    game[:,blocklen,0] = 0  # left wall
-    game[:,-blocklen-1,0] = 0  # right wall
+    game[blocklen,:] = 0  # top wall
+    game[-blocklen-1,:] = 0  # ground wall
+    game[:,blocklen] = 0  # left wall
+    game[:,-blocklen-1] = 0  # right wall
+
+    lap('spawn_finish')
+
+    if check_reachable:
+        finishable = is_finishable(game)
+        lap('reachability')
+        if not finishable:
+            raise UnreachableError('the finish can\'t be reached from the spawn')
 
     # generate visual tile layers
-    layer_unhookable = np.zeros(game.shape, dtype='B')
-    layer_unhookable[:,:,0] = np.array(np.where(game[:,:,0] == 3, 8, 0), dtype='B')  # walls
-    layer_desert = np.zeros(game.shape, dtype='B')
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 1, np.random.choice(np.array([7,64,65], dtype='B'), game[:,:,0].shape), 0), dtype='B')  # obstacles
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 9, 126, 0), dtype='B')  # freeze
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 33, 94, 0), dtype='B')  # start line
-    layer_desert[:,:,0] += np.array(np.where(game[:,:,0] == 34, 94, 0), dtype='B')  # finish line
+    layers = tile_layers(game, TILE_LAYERS, rng)
+    lap('visual_layers')
 
     # generate the map file
-    create_map(game, [('generic_unhookable', layer_unhookable), ('desert_main', layer_desert)], filename=filename)
+    create_map(game, layers, filename=filename)
 
 
 
 # generate a map when the script is called from the command line
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        create_spiral(sys.argv[1])
-    else:
-        create_spiral()
+    parser = argparse.ArgumentParser(description='create a spiral map')
+    parser.add_argument('filename', nargs='?', default=None, help='map file to write (default: newmap.map), - for stdout')
+    parser.add_argument('--profile', metavar='REPORT', help='save stage timings and counters as json to REPORT')
+    args = parser.parse_args()
+    with profile_to(args.profile):
+        create_spiral(args.filename)
@@ -0,0 +1,29 @@
+'''add freeze around blocks of a game layer in one pass'''
+
+
+
+def dilate(mask):
+    '''grow a 2d boolean mask by one tile in all 8 directions'''
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    rows = grown.copy()
+    grown[:,1:] |= rows[:,:-1]
+    grown[:,:-1] |= rows[:,1:]
+    return grown
+
+
+def add_freeze(game, sources, block_freeze=9, band=256):
+    '''put freeze around all source tiles of the 2d `game` plane that are still blocks, without overwriting anything
+
+    works on bands of `band` rows so the temporary masks stay small for large maps, `sources` is updated in place
+    '''
+    # drop sources that aren't blocks anymore, before any freeze is added
+    for start in range(0, len(game), band):
+        sources[start:start+band] &= game[start:start+band] != 0
+    # dilate each band with one extra row above and below
+    for start in range(0, len(game), band):
+        above = min(start, 1)
+        halo = dilate(sources[start-above:start+band+1])[above:above+band]
+        rows = game[start:start+band]
+        rows[halo & (rows == 0)] = block_freeze
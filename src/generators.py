@@ -0,0 +1,46 @@
+'''map generators by name'''
+
+from create_layered import create_layered, source_version
+from create_spiral import create_spiral
+from create_random_blocks import create_random_blocks
+from reachability import UnreachableError
+
+
+
+GENERATORS = {
+    'layered': create_layered,
+    'spiral': create_spiral,
+    'random_blocks': create_random_blocks,
+}
+CHECKED_GENERATORS = {'layered', 'spiral'}  # generators that can check that their maps are finishable
+SHARED_MODULES = ['map_creator', 'random_streams', 'obstacles', 'tilesets', 'freeze', 'reachability']  # used by the generators
+
+
+def generator_version(generator):
+    '''hash of the source code of a generator and the modules it builds on, changes whenever its maps might change'''
+    return source_version(GENERATORS[generator].__module__, *SHARED_MODULES)
+
+
+def generate(generator, filename=None, seed=None, **params):
+    '''generate a map with the generator called `generator`'''
+    if generator not in GENERATORS:
+        raise ValueError(f'unknown generator {generator!r}, choose one of: {", ".join(GENERATORS)}')
+    GENERATORS[generator](filename=filename, seed=seed, **params)
+
+
+def generate_valid(generator, filename=None, seed=None, attempts=100, **params):
+    '''generate a map whose finish can be reached from the spawn and return `(seed, attempts)` of it
+
+    the first attempt uses `seed`, retries use the seeds `(seed, 1)`, `(seed, 2)`, ... (or random ones if `seed` is None),
+    a candidate is dropped as soon as the generator finds a blocked part
+    '''
+    if generator not in CHECKED_GENERATORS:
+        raise ValueError(f'generator {generator!r} can\'t check its maps, choose one of: {", ".join(sorted(CHECKED_GENERATORS))}')
+    for attempt in range(attempts):
+        attempt_seed = seed if attempt == 0 or seed is None else (seed, attempt)
+        try:
+            generate(generator, filename, attempt_seed, check_reachable=True, **params)
+            return attempt_seed, attempt + 1
+        except UnreachableError:
+            continue
+    raise UnreachableError(f'no finishable map in {attempts} attempts')
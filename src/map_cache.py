@@ -0,0 +1,115 @@
+'''disk cache of generated maps, keyed by generator, parameters, seed and generator version'''
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+from generators import generate, generate_valid, generator_version
+from profiling import profiler
+
+
+
+class MapCache:
+    '''finished map files in `directory`, named by the hash of everything that determines their content
+
+    entries are written to a temporary file and renamed into place, so readers never see half written maps
+    and several processes can share the directory. a hit updates the modification time of the map,
+    once the maps take more than `max_bytes` the least recently used ones are deleted
+    '''
+    def __init__(self, directory, max_bytes=1024**3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, generator, seed, params, attempts=0):
+        '''canonical hash of a map request, None if it can't be cached (random seed)'''
+        if seed is None:
+            return None
+        request = {'generator': generator, 'version': generator_version(generator), 'seed': seed, 'params': params, 'valid': attempts}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def _paths(self, key):
+        return self.directory / f'{key}.map', self.directory / f'{key}.json'
+
+    def get(self, key):
+        '''return `(map bytes, info)` of a cached map or None'''
+        map_path, info_path = self._paths(key)
+        try:
+            data = map_path.read_bytes()
+            info = json.loads(info_path.read_text())
+            os.utime(map_path)
+        except FileNotFoundError:  # not cached, or evicted by another process meanwhile
+            self.misses += 1
+            profiler.count('map_cache_misses')
+            return None
+        self.hits += 1
+        profiler.count('map_cache_hits')
+        return data, info
+
+    def temp_filename(self):
+        '''a new temporary file in the cache directory, to write a map or its info into and `put` it in place by renaming'''
+        fd, filename = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        return filename
+
+    def put(self, key, filename, info):
+        '''move the map `filename` (in the cache directory) into the cache, together with a json `info` dict'''
+        map_path, info_path = self._paths(key)
+        info_filename = self.temp_filename()
+        Path(info_filename).write_text(json.dumps(info))
+        os.replace(info_filename, info_path)
+        os.replace(filename, map_path)  # the map last, its presence marks a complete entry
+        self.evict()
+
+    def evict(self):
+        '''delete the least recently used maps until all maps fit into `max_bytes`'''
+        maps = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.map'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                maps.append((stat.st_mtime, stat.st_size, entry.name[:-4]))
+        total = sum(size for _, size, _ in maps)
+        for _, size, key in sorted(maps):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                path.unlink(missing_ok=True)
+            total -= size
+            profiler.count('map_cache_evictions')
+
+    def generate(self, generator, seed=None, attempts=0, **params):
+        '''return `(map bytes, info)` from the cache, or generate, cache and return the map
+
+        info holds the seed of the map (which differs from `seed` if `attempts` were needed to find a finishable one)
+        '''
+        key = self.key(generator, seed, params, attempts)
+        if key is not None:
+            cached = self.get(key)
+            if cached:
+                return cached
+        buffer = io.BytesIO()
+        if attempts:
+            map_seed, used = generate_valid(generator, buffer, seed, attempts, **params)
+            info = {'seed': map_seed, 'attempts': used}
+        else:
+            generate(generator, buffer, seed, **params)
+            info = {'seed': seed}
+        data = buffer.getvalue()
+        if key is not None:
+            filename = self.temp_filename()
+            try:
+                Path(filename).write_bytes(data)
+                self.put(key, filename, info)
+            finally:
+                Path(filename).unlink(missing_ok=True)
+        return data, info
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
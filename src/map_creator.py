@@ -1,7 +1,15 @@
 '''generate a teeworlds/ddnet map given items and data'''
 
+import hashlib
+import struct
+import sys
+import threading
 import zlib
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+import numpy as np
+from profiling import profiler
 
 
 
@@ -22,13 +30,228 @@ class Item:
 
     def toByte(self):
         '''converte to bytestring'''
-        return toByte((self.type << 16) + self.id) + toByte(len(self.data) * 4) + b''.join(toByte(x) for x in self.data)
+        return _pack_ints([(self.type << 16) + self.id, len(self.data) * 4] + list(self.data))
 
 
-def save_map(items, data, filename):
-    '''generate a byte sequence from items and data, add required info and save it'''
-    # compress data
-    compressed_data = [zlib.compress(x) for x in data]
+def _pack_ints(ints):
+    '''pack a sequence of ints as little endian int32 in one go'''
+    return struct.pack(f'<{len(ints)}I', *ints)
+
+
+class TilePlane:
+    '''a tilemap kept as 2d plane of tile ids (one byte per tile)
+
+    the 4 byte per tile layout (id, flags, skip, reserved) of the map file is only built for a few rows at a time
+    while compressing, `convert` optionally maps each chunk of plane rows to the tile ids to write
+    '''
+    chunk_rows = 256
+
+    def __init__(self, plane, convert=None, convert_key=None):
+        self.plane = plane
+        self.convert = convert
+        self.convert_key = convert_key  # bytes identifying `convert` if it always gives the same tiles for the same rows
+        self.shape = plane.shape
+
+    def __len__(self):
+        '''return the length of the uncompressed data'''
+        return self.shape[0] * self.shape[1] * 4
+
+    def chunks(self):
+        '''yield the uncompressed data in chunks of rows, reusing one buffer'''
+        buffer = np.zeros((self.chunk_rows, self.shape[1], 4), dtype='B')
+        for start in range(0, self.shape[0], self.chunk_rows):
+            rows = self.plane[start:start+self.chunk_rows]
+            chunk = buffer[:len(rows)]
+            chunk[:,:,0] = self.convert(rows) if self.convert else rows
+            yield chunk
+
+    def digest(self):
+        '''hash of the content, None if `convert` isn't deterministic'''
+        if self.convert and self.convert_key is None:
+            return None
+        h = hashlib.blake2b(b'plane' + (self.convert_key or b''), digest_size=16)
+        h.update(np.ascontiguousarray(self.plane))
+        return h.digest()
+
+    def compress(self):
+        '''compress the tiles chunk by chunk into one zlib stream'''
+        compressor = zlib.compressobj()
+        return b''.join([compressor.compress(x) for x in self.chunks()] + [compressor.flush()])
+
+
+class CompressedBlock:
+    '''a data block that is already compressed, e.g. read from an existing map, it is written as is'''
+    def __init__(self, compressed, length):
+        self.compressed = compressed
+        self.length = length
+
+    def __len__(self):
+        '''return the length of the uncompressed data'''
+        return self.length
+
+    def compress(self):
+        return self.compressed
+
+
+def as_tile_data(matrix):
+    '''wrap a 2d plane of tile ids as `TilePlane`, tile planes are kept and (height, width, 4) arrays become bytes'''
+    if isinstance(matrix, TilePlane):
+        return matrix
+    if matrix.ndim == 2:
+        return TilePlane(matrix)
+    return matrix.tobytes()
+
+
+def digest(x):
+    '''hash of the content of a data block, None if it can't be hashed'''
+    if isinstance(x, TilePlane):
+        return x.digest()
+    if isinstance(x, CompressedBlock):
+        return None  # the content is unknown without decompressing
+    return hashlib.blake2b(x, digest_size=16).digest()
+
+
+class CompressionCache:
+    '''compressed data blocks by content hash, shared by all maps written in this process
+
+    the least recently used blocks are dropped once the compressed blocks take more than `max_bytes`
+    '''
+    def __init__(self, max_bytes=64*1024*1024):
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()  # digest -> compressed block, least recently used first
+        self._cached_bytes = 0
+        self._lock = threading.Lock()  # blocks are compressed on several threads
+
+    def get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._cache or len(block) > self.max_bytes:
+                return
+            self._cache[key] = block
+            self._cached_bytes += len(block)
+            while self._cached_bytes > self.max_bytes:
+                self._cached_bytes -= len(self._cache.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+
+compression_cache = CompressionCache()
+
+
+def compress(x, key=None, cache=None):
+    '''compress one data block, either bytes, a `TilePlane` or a `CompressedBlock`, looking it up in `cache` by its `key` (digest) first'''
+    if cache is not None and key is not None:
+        block = cache.get(key)
+        if block is not None:
+            profiler.count('compression_cache_hits')
+            return block
+    block = x.compress() if isinstance(x, (TilePlane, CompressedBlock)) else zlib.compress(x)
+    if cache is not None and key is not None:
+        cache.put(key, block)
+    return block
+
+
+def compress_data(data, workers=None, keys=None, cache=None):
+    '''compress all data blocks, on a pool of `workers` threads if given (zlib releases the GIL), keeping the order
+
+    `keys` are the digests of the blocks to look them up in `cache`
+    '''
+    keys = keys or [None] * len(data)
+    if workers and workers > 1 and len(data) > 1:
+        with ThreadPoolExecutor(min(workers, len(data))) as executor:
+            return list(executor.map(compress, data, keys, [cache] * len(data)))
+    return [compress(x, key, cache) for x, key in zip(data, keys)]
+
+
+# item type -> fields holding data indices
+DATA_INDEX_FIELDS = {
+    0: (),  # version
+    1: (1, 2, 3, 4, 5),  # info: author, map version, credits, license, settings
+    2: (4, 5),  # image: name, data
+    3: (),  # envelopes
+    4: (),  # groups
+    6: (),  # envpoints
+    0xffff: (),  # ddnet uuid index
+}
+LAYER_DATA_INDEX_FIELDS = {
+    2: (14, 18, 19, 20, 21, 22),  # tilemap: data, tele, speedup, front, switch, tune
+    3: (5,),  # quads
+}
+
+
+def data_index_fields(items):
+    '''the fields holding data indices of each item, None if an item of an unknown type might point to data'''
+    fields = []
+    for item in items:
+        if item.type == 5:
+            if len(item.data) < 2 or item.data[1] not in LAYER_DATA_INDEX_FIELDS:
+                return None
+            fields.append(LAYER_DATA_INDEX_FIELDS[item.data[1]])
+        elif item.type in DATA_INDEX_FIELDS:
+            fields.append(DATA_INDEX_FIELDS[item.type])
+        else:
+            return None
+    return fields
+
+
+def deduplicate_data(items, data):
+    '''merge data blocks with the same content, return new items pointing to the kept blocks, the kept blocks and their digests
+
+    blocks that can't be hashed are only merged with themselves (the same object).
+    if an item of an unknown type might point to data, nothing is merged
+    '''
+    fields = data_index_fields(items)
+    if fields is None:
+        return items, data, [digest(x) for x in data]
+
+    # keep the first block of each content
+    unique, keys, new_index, first = [], [], [], {}
+    for x in data:
+        key = digest(x)
+        known = first.setdefault(key if key is not None else id(x), len(unique))
+        if known == len(unique):
+            unique.append(x)
+            keys.append(key)
+        new_index.append(known)
+    if len(unique) == len(data):
+        return items, data, keys
+    profiler.count('blocks_deduplicated', len(data) - len(unique))
+
+    # point items to the kept blocks
+    new_items = []
+    for item, item_fields in zip(items, fields):
+        values = list(item.data)
+        for i in item_fields:
+            if i < len(values) and values[i] < len(data):
+                values[i] = new_index[values[i]]
+        new_items.append(Item(item.id, item.type, values))
+    return new_items, unique, keys
+
+
+def write_map(f, items, data, workers=None, dedup=True, cache=compression_cache):
+    '''compress data, calculate all offsets up front and write the map to the writable binary file object `f` in one pass
+
+    with `dedup`, data blocks with the same content are written once and shared by all items pointing to them.
+    compressed blocks are looked up in and added to `cache` (by content hash), None disables this
+    '''
+    # merge identical blocks and compress data
+    lap = profiler.laps()
+    if dedup:
+        items, data, keys = deduplicate_data(items, data)
+    else:
+        keys = [digest(x) for x in data] if cache is not None else None
+    lap('dedup')
+    compressed_data = compress_data(data, workers, keys, cache)
+    profiler.count('bytes_compressed', sum(len(x) for x in data if not isinstance(x, CompressedBlock)))
+    lap('compress')
 
     # calculate itemtypes
     itemtypes = []
@@ -45,50 +268,54 @@ def save_map(items, data, filename):
     #         itemtypes.append((itemtype, items_considered_so_far, count))
     #     items_considered_so_far += count
 
+    # calculate offsets
+    item_offsets = [0] + list(accumulate(len(x) for x in items))
+    data_offsets = [0] + list(accumulate(len(x) for x in compressed_data))
+
     # calculate header
-    item_area_size = sum(len(x) for x in items)
-    data_area_size = sum(len(x) for x in compressed_data)
+    item_area_size = item_offsets.pop()
+    data_area_size = data_offsets.pop()
     swaplen =  36 - 16 + 12*len(itemtypes) + 4*len(items) + 2*4*len(data) + item_area_size  # size before data (-16, because it starts after `swaplen`)
     size = swaplen + data_area_size  # size of everything after `swaplen`
     header = [4, size, swaplen, len(itemtypes), len(items), len(data), item_area_size, data_area_size]
 
-    # create byte result
-    result = b'DATA'
-    # add header
-    for x in header:
-        result += toByte(x)
-    # add itemtypes info
-    for x in itemtypes:
-        for y in x:
-            result += toByte(y)
-    # add item offsets
-    curr_offset = 0
-    for x in items:
-        result += toByte(curr_offset)
-        curr_offset += len(x)
-    # add compressed data offsets
-    curr_offset = 0
-    for x in compressed_data:
-        result += toByte(curr_offset)
-        curr_offset += len(x)
-    # add uncompressed data lengths
-    for x in data:
-        result += toByte(len(x))
-    # add items
-    for item in items:
-        result += item.toByte()
-    # add compressed data
-    for x in compressed_data:
-        result += x
+    lap('offsets')
+
+    # write header, itemtypes info, item offsets, compressed data offsets and uncompressed data lengths
+    f.write(b'DATA' + _pack_ints(header + [y for x in itemtypes for y in x] + item_offsets + data_offsets + [len(x) for x in data]))
+    # write items
+    f.write(_pack_ints([y for item in items for y in ((item.type << 16) + item.id, len(item.data) * 4, *item.data)]))
+    # write compressed data, dropping each block once it is written
+    for i in range(len(compressed_data)):
+        f.write(compressed_data[i])
+        compressed_data[i] = None
+    profiler.count('bytes_written', 16 + size)
+    lap('write')
 
-    # write
+
+def save_map(items, data, filename, workers=None, dedup=True):
+    '''generate a byte sequence from items and data, add required info and save it
+
+    `filename` can also be a writable binary file object (e.g. `io.BytesIO`, a pipe or a socket file), which is
+    written to in one pass without seeking and left open, or '-' for stdout
+    '''
+    if filename == '-':
+        filename = sys.stdout.buffer
+    if hasattr(filename, 'write'):
+        write_map(filename, items, data, workers, dedup)
+        filename.flush()
+        return
     filename = filename if filename else 'newmap.map'
     with open(filename, 'wb') as f:
-        f.write(result)
+        write_map(f, items, data, workers, dedup)
+
 
+def create_map(game_matrix, tile_layers=[], filename=None, workers=None):
+    '''create the map items and data from a given matrix, data blocks are compressed on `workers` threads if given
 
-def create_map(game_matrix, tile_layers=[], filename=None):
-    '''create the map items and data from a given matrix'''
+    the game matrix and tile layers can be 2d planes of tile ids, `TilePlane`s or (height, width, 4) arrays.
+    `filename` can be a file object as well, see `save_map`
+    '''
     # ids should probably be unique per type
     # items should be ordered by type
 
@@ -114,11 +341,11 @@ def create_map(game_matrix, tile_layers=[], filename=None):
     # * quads: .., version, num_quads, data, image, name
     items += [
         # game layer
-        Item(0, 5, [0, 2, 0, 3, game_matrix.shape[0], game_matrix.shape[1], 1, 255, 255, 255, 255, 0xffffffff, 0, 0xffffffff, len(tile_layers)] + name_game + [0xffffffff]*5)
+        Item(0, 5, [0, 2, 0, 3, game_matrix.shape[1], game_matrix.shape[0], 1, 255, 255, 255, 255, 0xffffffff, 0, 0xffffffff, len(tile_layers)] + name_game + [0xffffffff]*5)
     ]
     for i, (imagename, matrix) in enumerate(tile_layers,1):
         # tile layers
-        items += [Item(i, 5, [0, 2, 0, 3, matrix.shape[0], matrix.shape[1], 0, 255, 255, 255, 255, 0xffffffff, 0, i-1, len(tile_layers)+i] + name_empty + [0xffffffff]*5)]
+        items += [Item(i, 5, [0, 2, 0, 3, matrix.shape[1], matrix.shape[0], 0, 255, 255, 255, 255, 0xffffffff, 0, i-1, len(tile_layers)+i] + name_empty + [0xffffffff]*5)]
 
     # add end item
     items += [Item(0, 6, [])]  # add an empty envpoint item at the end
@@ -130,12 +357,14 @@ def create_map(game_matrix, tile_layers=[], filename=None):
     # ]
 
     # add generated data
+    lap = profiler.laps()
     data = []
     for imagename, matrix in tile_layers:
         data += [bytes(imagename+'\0','utf-8')]  # image names
-    data += [game_matrix.tobytes()]  # game layer
+    data += [as_tile_data(game_matrix)]  # game layer
     for imagename, matrix in tile_layers:
-        data += [matrix.tobytes()]  # tiles layers
+        data += [as_tile_data(matrix)]  # tiles layers
+    lap('data')
 
     # create bytestream and save it as map file
-    save_map(items, data, filename)
+    save_map(items, data, filename, workers)
@@ -0,0 +1,146 @@
+'''compare two maps (or two directories of maps) header, item and layer wise'''
+
+import argparse
+import hashlib
+import sys
+from pathlib import Path
+import numpy as np
+from map_reader import MapFile, TilemapLayerItem, item_fields
+
+
+
+HEADER_FIELDS = ['version', 'size', 'swaplen', 'num_itemtypes', 'num_items', 'num_rawdata', 'item_area_size', 'data_area_size']
+
+
+def block_hashes(m):
+    '''hash the compressed data blocks of a map without decompressing them'''
+    return [hashlib.blake2b(m.raw_data(i), digest_size=16).digest() for i in range(m.num_rawdata)]
+
+
+def diff_items(a, b):
+    '''compare items with the same type and id field by field, yield a line per difference'''
+    items_a = {(x.type, x.id): x for x in a.items}
+    items_b = {(x.type, x.id): x for x in b.items}
+    for key in sorted(items_a.keys() | items_b.keys()):
+        if key not in items_b:
+            yield f'item {key[0]}:{key[1]} ({type(items_a[key]).__name__}) removed'
+            continue
+        if key not in items_a:
+            yield f'item {key[0]}:{key[1]} ({type(items_b[key]).__name__}) added'
+            continue
+        x, y = items_a[key], items_b[key]
+        if np.array_equal(x.data, y.data):
+            continue
+        name = type(x).__name__ if type(x) is type(y) else f'{type(x).__name__} -> {type(y).__name__}'
+        fields = item_fields(type(x)) if type(x) is type(y) else []
+        # named fields first, then the remaining ints by index
+        named = set()
+        for field_name, f in fields:
+            end = f.index + f.count
+            if end > len(x.data) and end > len(y.data):
+                continue
+            named.update(range(f.index, end))
+            if end > len(x.data) or end > len(y.data):  # older item versions are shorter, the length line covers the rest
+                yield f'item {key[0]}:{key[1]} ({name}) {field_name}: ' + (f'missing -> {getattr(y, field_name)!r}' if end > len(x.data) else f'{getattr(x, field_name)!r} -> missing')
+            elif x.data[f.index:end].tolist() != y.data[f.index:end].tolist():
+                yield f'item {key[0]}:{key[1]} ({name}) {field_name}: {getattr(x, field_name)!r} -> {getattr(y, field_name)!r}'
+        if len(x.data) != len(y.data):
+            yield f'item {key[0]}:{key[1]} ({name}) length: {len(x.data)} -> {len(y.data)} ints'
+        for i in np.flatnonzero(x.data[:len(y.data)] != y.data[:len(x.data)]).tolist():
+            if i not in named:
+                yield f'item {key[0]}:{key[1]} ({name}) [{i}]: {int(x.data[i])} -> {int(y.data[i])}'
+
+
+def diff_tiles(tiles_a, tiles_b):
+    '''describe the changed tiles of two (height, width, 4) tilemaps of the same size, None if they are equal'''
+    changed = (tiles_a != tiles_b).any(axis=2)
+    count = int(np.count_nonzero(changed))
+    if not count:
+        return None
+    rows = np.flatnonzero(changed.any(axis=1))
+    cols = np.flatnonzero(changed.any(axis=0))
+    # how many tiles of each id were there before and after in the changed region
+    before = np.bincount(tiles_a[:,:,0][changed], minlength=256)
+    after = np.bincount(tiles_b[:,:,0][changed], minlength=256)
+    tiles = ', '.join(f'{tile}: {before[tile]} -> {after[tile]}' for tile in np.flatnonzero(before != after).tolist())
+    return f'{count} tiles changed in rows {rows[0]}-{rows[-1]}, columns {cols[0]}-{cols[-1]}' + (f' ({tiles})' if tiles else '')
+
+
+def diff_maps(filename_a, filename_b):
+    '''return a list of lines describing all differences between two maps, empty if they have the same content
+
+    data blocks are compared by the hash of their compressed bytes first, only blocks that differ are decompressed
+    '''
+    lines = []
+    with MapFile(filename_a) as a, MapFile(filename_b) as b:
+        # header and item types
+        for name in HEADER_FIELDS:
+            if getattr(a, name) != getattr(b, name):
+                lines.append(f'header {name}: {getattr(a, name)} -> {getattr(b, name)}')
+        if not np.array_equal(a.itemtypes, b.itemtypes):
+            lines.append(f'itemtypes: {a.itemtypes.tolist()} -> {b.itemtypes.tolist()}')
+
+        # items
+        lines += diff_items(a, b)
+
+        # tile layers, in the order they appear
+        hashes_a, hashes_b = block_hashes(a), block_hashes(b)
+        layers_a, layers_b = a.items_of_type(TilemapLayerItem), b.items_of_type(TilemapLayerItem)
+        tile_blocks = set()
+        for i, (x, y) in enumerate(zip(layers_a, layers_b)):
+            tile_blocks.add((x.data_index, y.data_index))
+            if hashes_a[x.data_index] == hashes_b[y.data_index]:
+                continue
+            if (x.height, x.width) != (y.height, y.width):
+                lines.append(f'tile layer {i}: size {x.width}x{x.height} -> {y.width}x{y.height}')
+                continue
+            changes = diff_tiles(a.get_tilemap(x), b.get_tilemap(y))
+            if changes:
+                lines.append(f'tile layer {i}: {changes}')
+        if len(layers_a) != len(layers_b):
+            lines.append(f'tile layers: {len(layers_a)} -> {len(layers_b)}')
+
+        # remaining data blocks
+        for i in range(min(a.num_rawdata, b.num_rawdata)):
+            if hashes_a[i] == hashes_b[i] or (i, i) in tile_blocks:
+                continue
+            x, y = a.data[i], b.data[i]
+            if x == y:
+                lines.append(f'data {i}: same content, compressed differently')
+            else:
+                lines.append(f'data {i}: content differs ({len(x)} -> {len(y)} bytes)')
+    return lines
+
+
+def map_pairs(path_a, path_b):
+    '''pairs of maps to compare, the maps with the same name if both paths are directories'''
+    path_a, path_b = Path(path_a), Path(path_b)
+    if not path_a.is_dir():
+        return [(path_a, path_b)]
+    names = sorted({x.name for x in path_a.glob('*.map')} | {x.name for x in path_b.glob('*.map')})
+    return [(path_a / name, path_b / name) for name in names]
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='compare two maps, or all maps with the same names in two directories, exit with 1 if any differ')
+    parser.add_argument('a')
+    parser.add_argument('b')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only list the maps that differ')
+    args = parser.parse_args()
+    differing = 0
+    pairs = map_pairs(args.a, args.b)
+    for path_a, path_b in pairs:
+        if not path_a.exists() or not path_b.exists():
+            print(f'{path_a.name}: only in {path_a.parent if path_a.exists() else path_b.parent}')
+            differing += 1
+            continue
+        lines = diff_maps(path_a, path_b)
+        if lines:
+            differing += 1
+            print(f'{path_a.name}: differs')
+            if not args.quiet:
+                print(''.join(f'  {x}\n' for x in lines), end='')
+    if len(pairs) > 1:
+        print(f'{differing} of {len(pairs)} maps differ')
+    sys.exit(1 if differing else 0)
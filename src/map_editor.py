@@ -0,0 +1,125 @@
+'''edit existing maps, data blocks that aren't changed are written back without decompressing them
+
+    with MapEditor('in.map') as m:
+        tiles = m.get_tiles(0).copy()   # the first tile layer (usually the game layer)
+        tiles[10:20, 10:20, 0] = 1
+        m.set_tiles(0, tiles)
+        m.save('out.map')
+'''
+
+import os
+import tempfile
+import zlib
+from pathlib import Path
+import numpy as np
+from map_creator import Item, CompressedBlock, TilePlane, as_tile_data, data_index_fields, write_map
+from map_reader import MapFile, TilemapLayerItem, make_item
+
+
+
+class MapEditor:
+    '''items and data blocks of a map, to change and save again
+
+    `items` are `map_creator.Item`s with the ints of the original items and `data` holds a `CompressedBlock` with the
+    original compressed bytes for every block until it is replaced, so saving only compresses the changed blocks
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.mapfile = MapFile(filename)
+        m = self.mapfile
+        self.items = [Item(x.id, x.type, x.data.tolist()) for x in m.items]
+        lengths = m.uncompressed_data_lengths.tolist() if m.uncompressed_data_lengths is not None else [len(x) for x in m.data]
+        self.data = [CompressedBlock(m.raw_data(i), length) for i, length in enumerate(lengths)]
+
+    def view(self, item):
+        '''the item as item class of the reader, e.g. `TilemapLayerItem`, to read its fields by name'''
+        return make_item(item.id, item.type, np.array(item.data, '<u4'))
+
+    def tilemap_layers(self):
+        '''the items of all tilemap layers, in the order they appear'''
+        return [x for x in self.items if isinstance(self.view(x), TilemapLayerItem)]
+
+    def get_data(self, index):
+        '''decompressed content of data block `index` as bytes'''
+        x = self.data[index]
+        if isinstance(x, CompressedBlock):
+            return zlib.decompress(x.compressed)
+        if isinstance(x, TilePlane):
+            return b''.join(chunk.tobytes() for chunk in x.chunks())
+        return bytes(x)
+
+    def set_data(self, index, data):
+        '''replace data block `index` by bytes or a `TilePlane`'''
+        self.data[index] = data
+
+    def get_tiles(self, layer):
+        '''tiles of tilemap layer number `layer` as read-only (height, width, 4) uint8 array, only this layer is decompressed'''
+        item = self.view(self.tilemap_layers()[layer])
+        return np.frombuffer(self.get_data(item.data_index), np.uint8).reshape(item.height, item.width, 4)
+
+    def set_tiles(self, layer, tiles):
+        '''replace the tiles of tilemap layer number `layer`, by a 2d plane of tile ids, a `TilePlane` or a (height, width, 4) array
+
+        the size of the layer follows the new tiles. a block other items point to as well (or might, with items
+        of unknown types) is left to them and the layer gets a new block
+        '''
+        item = self.tilemap_layers()[layer]
+        index = self.view(item).data_index
+        item.data[TilemapLayerItem.width.index] = tiles.shape[1]
+        item.data[TilemapLayerItem.height.index] = tiles.shape[0]
+        if self.references(index) == 1:
+            self.data[index] = as_tile_data(tiles)
+        else:
+            item.data[TilemapLayerItem.data_index.index] = len(self.data)
+            self.data.append(as_tile_data(tiles))
+
+    def references(self, index):
+        '''how many item fields point to data block `index`, None if unknown (items of unknown types)'''
+        fields = data_index_fields(self.items)
+        if fields is None:
+            return None
+        return sum(item.data[i] == index for item, item_fields in zip(self.items, fields) for i in item_fields if i < len(item.data))
+
+    def referenced(self):
+        '''items and data without the blocks no item points to (e.g. replaced layers), all blocks if that is unknown'''
+        fields = data_index_fields(self.items)
+        if fields is None:
+            return self.items, self.data
+        used = sorted({item.data[i] for item, item_fields in zip(self.items, fields) for i in item_fields if i < len(item.data) and item.data[i] < len(self.data)})
+        if len(used) == len(self.data):
+            return self.items, self.data
+        new_index = {old: new for new, old in enumerate(used)}
+        items = []
+        for item, item_fields in zip(self.items, fields):
+            values = list(item.data)
+            for i in item_fields:
+                if i < len(values) and values[i] in new_index:
+                    values[i] = new_index[values[i]]
+            items.append(Item(item.id, item.type, values))
+        return items, [self.data[i] for i in used]
+
+    def save(self, filename=None, workers=None, dedup=True):
+        '''write the map to `filename` (default: overwrite the original), only replaced blocks are compressed
+
+        the map is written to a temporary file first and renamed, overwriting the original closes the editor
+        '''
+        filename = Path(filename or self.filename)
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=filename.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_map(f, *self.referenced(), workers, dedup)
+            if filename.exists() and os.path.samefile(filename, self.filename):
+                self.close()
+            os.replace(temp, filename)
+        finally:
+            Path(temp).unlink(missing_ok=True)
+
+    def close(self):
+        self.data = []
+        self.mapfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
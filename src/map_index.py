@@ -0,0 +1,139 @@
+'''index a directory of maps in sqlite, reading only headers, items and image names
+
+    python map_index.py scan maps/ --db maps.sqlite      (re-scans only maps whose mtime or size changed)
+    python map_index.py find --image grass_main --min-tiles 1000000 --db maps.sqlite
+'''
+
+import argparse
+import hashlib
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from map_reader import MapFile, ImageItem, LayerItem, TilemapLayerItem, QuadLayerItem
+
+
+
+SCHEMA = '''
+create table if not exists maps (
+    path text primary key, mtime real, size integer, sha256 text, error text,
+    version integer, num_items integer, num_rawdata integer, data_size integer,
+    width integer, height integer, tiles integer  -- of the game layer
+);
+create table if not exists layers (path text, layer integer, type text, is_game integer, width integer, height integer, image integer, name text);
+create table if not exists images (path text, image integer, name text, width integer, height integer, external integer);
+create table if not exists item_counts (path text, type integer, count integer);
+create index if not exists layers_path on layers (path);
+create index if not exists images_path on images (path);
+create index if not exists images_name on images (name);
+create index if not exists item_counts_path on item_counts (path);
+'''
+
+
+def scan_map(task):
+    '''read the index rows of one map, only image name blocks are decompressed'''
+    path, mtime, size = task
+    row = {'path': path, 'mtime': mtime, 'size': size, 'sha256': None, 'error': None}
+    layers, images, counts = [], [], []
+    try:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(2**20):
+                sha256.update(chunk)
+        row['sha256'] = sha256.hexdigest()
+        with MapFile(path) as m:
+            # version 3 maps have no uncompressed lengths
+            data_size = int(m.uncompressed_data_lengths.sum()) if m.uncompressed_data_lengths is not None else None
+            row.update(version=m.version, num_items=m.num_items, num_rawdata=m.num_rawdata, data_size=data_size)
+            for i, layer in enumerate(m.items_of_type(LayerItem)):
+                if isinstance(layer, TilemapLayerItem):
+                    layers.append((path, i, 'tiles', layer.is_game, layer.width, layer.height, layer.image_index, layer.name))
+                    if layer.is_game:
+                        row.update(width=layer.width, height=layer.height, tiles=layer.width * layer.height)
+                elif isinstance(layer, QuadLayerItem):
+                    layers.append((path, i, 'quads', False, None, None, layer.image_index, layer.name))
+                else:
+                    layers.append((path, i, 'other', False, None, None, None, None))
+            for i, image in enumerate(m.items_of_type(ImageItem)):
+                images.append((path, i, m.data[image.name_index].rstrip(b'\0').decode('utf-8', 'replace'), image.width, image.height, image.external))
+            counts = [(path, t, n) for t, n in sorted(Counter(x.type for x in m.items).items())]
+    except Exception as e:  # a broken map (bad header, corrupt blocks, ...) gets an error row instead of stopping the scan
+        layers, images, counts = [], [], []
+        row['error'] = f'{type(e).__name__}: {e}'
+    return row, layers, images, counts
+
+
+def open_index(db):
+    connection = sqlite3.connect(db)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def scan(directories, db='maps.sqlite', workers=None):
+    '''index all maps in `directories` (recursively), maps with unchanged mtime and size are skipped, deleted maps are removed
+
+    return the numbers of (scanned, unchanged, removed) maps
+    '''
+    connection = open_index(db)
+    known = {path: (mtime, size) for path, mtime, size in connection.execute('select path, mtime, size from maps')}
+    found = {}
+    for directory in directories:
+        for path in Path(directory).rglob('*.map'):
+            stat = path.stat()
+            found[str(path)] = (stat.st_mtime, stat.st_size)
+    tasks = [(path, *stat) for path, stat in found.items() if known.get(path) != stat]
+    removed = [path for path in known if path not in found and any(Path(path).is_relative_to(d) for d in directories)]
+
+    def delete(paths):
+        for table in ('maps', 'layers', 'images', 'item_counts'):
+            connection.executemany(f'delete from {table} where path = ?', [(x,) for x in paths])
+
+    with connection:
+        delete(removed + [path for path, _, _ in tasks])
+        with ProcessPoolExecutor(workers) as executor:
+            for row, layers, images, counts in executor.map(scan_map, tasks, chunksize=32):
+                connection.execute(f'insert into maps ({", ".join(row)}) values ({", ".join("?" * len(row))})', list(row.values()))
+                connection.executemany('insert into layers values (?, ?, ?, ?, ?, ?, ?, ?)', layers)
+                connection.executemany('insert into images values (?, ?, ?, ?, ?, ?)', images)
+                connection.executemany('insert into item_counts values (?, ?, ?)', counts)
+    connection.close()
+    return len(tasks), len(found) - len(tasks), len(removed)
+
+
+def find(db='maps.sqlite', image=None, min_tiles=None, max_tiles=None):
+    '''paths of indexed maps that use the image named `image` and whose game layer has between `min_tiles` and `max_tiles` tiles'''
+    conditions, params = ['error is null'], []
+    if image is not None:
+        conditions.append('path in (select path from images where name = ?)')
+        params.append(image)
+    if min_tiles is not None:
+        conditions.append('tiles >= ?')
+        params.append(min_tiles)
+    if max_tiles is not None:
+        conditions.append('tiles <= ?')
+        params.append(max_tiles)
+    connection = open_index(db)
+    paths = [path for path, in connection.execute(f'select path from maps where {" and ".join(conditions)} order by path', params)]
+    connection.close()
+    return paths
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='index maps in sqlite and search the index', formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--db', default='maps.sqlite', help='sqlite file of the index')
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan_parser = commands.add_parser('scan', help='add new and changed maps to the index, remove deleted ones')
+    scan_parser.add_argument('directories', nargs='+')
+    scan_parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    find_parser = commands.add_parser('find', help='list indexed maps')
+    find_parser.add_argument('--image', help='only maps using an image with this name')
+    find_parser.add_argument('--min-tiles', type=int, help='only maps whose game layer has at least this many tiles')
+    find_parser.add_argument('--max-tiles', type=int, help='only maps whose game layer has at most this many tiles')
+    args = parser.parse_args()
+    if args.command == 'scan':
+        scanned, unchanged, removed = scan(args.directories, args.db, args.workers)
+        print(f'scanned {scanned} maps, {unchanged} unchanged, removed {removed}')
+    else:
+        for path in find(args.db, args.image, args.min_tiles, args.max_tiles):
+            print(path)
@@ -1,6 +1,9 @@
 '''read a teeworlds map'''
 
+import mmap
 import sys, zlib
+from collections import OrderedDict
+import numpy as np
 
 
 
@@ -12,135 +15,283 @@ def intsToStr(arr):
     return ''.join(chr(y-128) if y >= 128 else '\0' for x in arr for y in x.to_bytes(4, 'big'))
 
 
+class ItemField(property):
+    '''property of an item, remembers which ints of the item data it reads'''
+    def __init__(self, getter, index, count):
+        super().__init__(getter)
+        self.index = index
+        self.count = count
+
+
+def field(index, count=1):
+    '''item property reading the int at `index` of the item data, or a tuple of `count` ints'''
+    if count == 1:
+        return ItemField(lambda self: int(self.data[index]), index, count)
+    return ItemField(lambda self: tuple(self.data[index:index+count].tolist()), index, count)
+
+
+def name_field(index):
+    '''item property decoding a name stored as 3 ints at `index` of the item data'''
+    return ItemField(lambda self: intsToStr(self.data[index:index+3].tolist()).rstrip('\0'), index, 3)
+
+
+def item_fields(cls):
+    '''all `(name, ItemField)` of an item class, ordered by their index'''
+    fields = {name: x for c in reversed(cls.__mro__) for name, x in vars(c).items() if isinstance(x, ItemField)}
+    return sorted(fields.items(), key=lambda x: x[1].index)
+
+
 class Item:
-    def __init__(self, f):
-        type_and_id = readInt(f)
+    __slots__ = ('type', 'id', 'len', 'data')
+    def __init__(self, id, type, data):  # same order as `map_creator.Item`
         # header (8)
-        self.type = (type_and_id >> 16) & 0xffff
-        self.id = type_and_id & 0xffff
-        self.len = readInt(f)
-        # print(f'{self.type = }, {self.id = }, {self.len = }')
-        self.data = [readInt(f) for i in range(self.len//4)]
-
-# class VersionItem(Item):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # version (4)
-#         self.version = readInt(f)
-
-# class InfoItem(VersionItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # info (16)
-#         self.author_index = readInt(f)
-#         self.map_version_index = readInt(f)
-#         self.credits_index = readInt(f)
-#         self.license_index = readInt(f)
-
-# class ImageItem(VersionItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # image (24)
-#         self.width = readInt(f)
-#         self.height = readInt(f)
-#         self.external = readInt(f)
-#         self.name = readInt(f)
-#         self.data = readInt(f)
-
-# class EnvelopesItem(VersionItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # envelopes (60)
-#         self.channels = readInt(f)
-#         self.start_point = readInt(f)
-#         self.num_point = readInt(f)
-#         self.name = tuple(readInt(f) for i in range(3))
-#         self.syncron = readInt(f)
-#         # TODO: check if smth is missing
-
-# class GroupItem(VersionItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # group (60)
-#         self.offset_x = readInt(f)
-#         self.offset_y = readInt(f)
-#         self.parallax_x = readInt(f)
-#         self.parallax_y = readInt(f)
-#         self.startlayer = readInt(f)
-#         self.numlayers = readInt(f)
-#         self.use_clipping = readInt(f)
-#         self.clip_x = readInt(f)
-#         self.clip_y = readInt(f)
-#         self.clip_w = readInt(f)
-#         self.clip_h = readInt(f)
-#         self.name = tuple(readInt(f) for i in range(3))
-
-# class LayerItem(VersionItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # layer
-#         self.type = readInt(f)  # invalid, game, tiles, quads
-#         self.flags = readInt(f)
-
-# class TilemapLayerItem(LayerItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # tilemap layer
-#         self.version = readInt(f)
-#         self.width = readInt(f)
-#         self.height = readInt(f)
-#         self.flags = readInt(f)
-#         self.color = tuple(readInt(f) for i in range(4))  # rgba
-#         self.colorenv = readInt(f)
-#         self.colorenv_offset = readInt(f)
-#         self.image = readInt(f)
-#         self.data = readInt(f)
-#         self.name = tuple(readInt(f) for i in range(3))
-
-# class QuadLayerItem(LayerItem):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # tilemap layer ()
-#         self.version = readInt(f)
-#         self.num_quads = readInt(f)
-#         self.data = readInt(f)
-#         self.image = readInt(f)
-#         self.name = [readInt(f) for i in range(3)]
-
-# class EnvpointItem(Item):
-#     def __init__(self, f):
-#         super().__init__(f)
-#         # envpoint (24)
-#         envpoint_time = readInt(f)
-#         envpoint_curvetype = readInt(f)
-#         envpoint_values = tuple(readInt(f) for i in range(4))
-
-# ITEM_TYPES = [VersionItem, InfoItem, ImageItem, EnvelopesItem, GroupItem, LayerItem, EnvpointItem, None, None]
+        self.type = type
+        self.id = id
+        self.len = len(data) * 4
+        self.data = data  # uint32 view over the item area (copied out of the map file)
 
+class VersionItem(Item):
+    __slots__ = ()
+    # version (4)
+    version = field(0)
+
+class InfoItem(VersionItem):
+    __slots__ = ()
+    # info (16)
+    author_index = field(1)
+    map_version_index = field(2)
+    credits_index = field(3)
+    license_index = field(4)
+
+class ImageItem(VersionItem):
+    __slots__ = ()
+    # image (24)
+    width = field(1)
+    height = field(2)
+    external = field(3)
+    name_index = field(4)
+    data_index = field(5)
+
+class EnvelopesItem(VersionItem):
+    __slots__ = ()
+    # envelopes (52)
+    channels = field(1)
+    start_point = field(2)
+    num_points = field(3)
+    name = field(4, 8)
+    synchronized = field(12)
+
+class GroupItem(VersionItem):
+    __slots__ = ()
+    # group (60)
+    offset_x = field(1)
+    offset_y = field(2)
+    parallax_x = field(3)
+    parallax_y = field(4)
+    startlayer = field(5)
+    numlayers = field(6)
+    use_clipping = field(7)
+    clip_x = field(8)
+    clip_y = field(9)
+    clip_w = field(10)
+    clip_h = field(11)
+    name = name_field(12)
+
+class LayerItem(VersionItem):
+    __slots__ = ()
+    # layer
+    layer_type = field(1)  # invalid, game, tiles, quads
+    flags = field(2)
+
+class TilemapLayerItem(LayerItem):
+    __slots__ = ()
+    # tilemap layer
+    tilemap_version = field(3)
+    width = field(4)
+    height = field(5)
+    tilemap_flags = field(6)  # Tiles,Game,Tele,Speedup,Front,Switch,Tune
+    color = field(7, 4)  # rgba
+    colorenv = field(11)
+    colorenv_offset = field(12)
+    image_index = field(13)
+    data_index = field(14)
+    name = name_field(15)
+
+    @property
+    def is_game(self):
+        return bool(self.tilemap_flags & 1)
+
+class QuadLayerItem(LayerItem):
+    __slots__ = ()
+    # quad layer
+    quads_version = field(3)
+    num_quads = field(4)
+    data_index = field(5)
+    image_index = field(6)
+    name = name_field(7)
+
+class EnvpointItem(Item):
+    __slots__ = ()
+    # envpoint (24)
+    time = field(0)
+    curvetype = field(1)
+    values = field(2, 4)
+
+ITEM_TYPES = {0: VersionItem, 1: InfoItem, 2: ImageItem, 3: EnvelopesItem, 4: GroupItem, 5: LayerItem, 6: EnvpointItem}
+LAYER_TYPES = {2: TilemapLayerItem, 3: QuadLayerItem}
+
+
+def make_item(id, type, data):
+    '''create the typed item view for the given item type (and layer type)'''
+    cls = ITEM_TYPES.get(type, Item)
+    if cls is LayerItem and len(data) > 1:
+        cls = LAYER_TYPES.get(int(data[1]), LayerItem)
+    return cls(id, type, data)
+
+
+class DataBlocks:
+    '''data blocks of a map file, decompressed when indexed and kept in a cache bounded by their size in bytes'''
+    def __init__(self, buffer, start, offsets, lengths, cache_size):
+        # only what is needed to find the blocks, not the map file itself, so there is no reference cycle
+        # and an unused map file is freed (and unmapped) right away
+        self._buffer = buffer
+        self._start = start  # of the data area
+        self._offsets = offsets
+        self._lengths = lengths
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # index -> decompressed block, least recently used first
+        self._cached_bytes = 0
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]  # normalize negative indices, raise IndexError if out of range
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        block = zlib.decompress(self.raw(index))
+        if len(block) <= self.cache_size:
+            self._cache[index] = block
+            self._cached_bytes += len(block)
+            while self._cached_bytes > self.cache_size:
+                self._cached_bytes -= len(self._cache.popitem(last=False)[1])
+        return block
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def raw(self, index):
+        '''compressed bytes of block `index` as a view over the mapped file'''
+        start = self._start + int(self._offsets[index])
+        return memoryview(self._buffer)[start:start+int(self._lengths[index])]
+
+    def clear(self):
+        self._cache.clear()
+        self._cached_bytes = 0
+
+
+class MapFile:
+    '''memory-mapped map file, header, tables and items are decoded in bulk (copied out of the small front of the file)
+
+    data blocks are decompressed lazily through `data`, which caches up to `cache_size` bytes of decompressed blocks.
+    only `raw_data` returns views over the mapped buffer, they have to be released before `close`
+    '''
+    def __init__(self, filename, cache_size=64*1024*1024):
+        with open(filename, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._items = None
 
-def read(filename, verbose=False):
-    with open(filename, "rb") as f:
         # read header
-        signature = f.read(4)
-        version, size, swaplen, num_itemtypes, num_items, num_rawdata, item_area_size, data_area_size = [readInt(f) for i in range(8)]
-        if verbose: print(f'header: {version = }, {size = }, {swaplen = }, {num_itemtypes = }, {num_items = }, {num_rawdata = }, {item_area_size = }, {data_area_size = }')
+        self.signature = self._buffer[:4]
+        if self.signature != b'DATA':
+            self._buffer.close()
+            raise ValueError(f'{filename} is not a (little endian) teeworlds map file')
+        self.header = np.frombuffer(self._buffer, '<u4', 8, 4).copy()
+        self.version, self.size, self.swaplen, self.num_itemtypes, self.num_items, self.num_rawdata, self.item_area_size, self.data_area_size = self.header.tolist()
 
         # read items info
-        itemtypes = [tuple(readInt(f) for x in range(3)) for i in range(num_itemtypes)]  # (type, start, count)
-        item_offsets = [readInt(f) for i in range(num_items)]
-        # item_lengths = [b-a for a, b in zip(item_offsets, item_offsets[1:] + [item_area_size])]
-        if verbose: print(f'{itemtypes = }')
+        offset = 36
+        self.itemtypes = np.frombuffer(self._buffer, '<u4', 3*self.num_itemtypes, offset).reshape(-1, 3).copy()  # (type, start, count)
+        offset += self.itemtypes.nbytes
+        self.item_offsets = np.frombuffer(self._buffer, '<u4', self.num_items, offset).copy()
+        offset += self.item_offsets.nbytes
 
         # read compressed data info
-        compressed_data_offsets = [readInt(f) for i in range(num_rawdata)]
-        compressed_data_lengths = [b-a for a, b in zip(compressed_data_offsets, compressed_data_offsets[1:] + [data_area_size])]
-        uncompressed_data_lengths = [readInt(f) for i in range(num_rawdata)]
+        self.compressed_data_offsets = np.frombuffer(self._buffer, '<u4', self.num_rawdata, offset).copy()
+        offset += self.compressed_data_offsets.nbytes
+        self.compressed_data_lengths = np.diff(self.compressed_data_offsets, append=np.uint32(self.data_area_size))
+        if self.version >= 4:  # version 3 doesn't store uncompressed data lengths
+            self.uncompressed_data_lengths = np.frombuffer(self._buffer, '<u4', self.num_rawdata, offset).copy()
+            offset += self.uncompressed_data_lengths.nbytes
+        else:
+            self.uncompressed_data_lengths = None
+
+        # item and data area
+        self.item_area = np.frombuffer(self._buffer, '<u4', self.item_area_size//4, offset).copy()  # items are views over this copy
+        self.data_area_start = offset + self.item_area_size
+        self.data = DataBlocks(self._buffer, self.data_area_start, self.compressed_data_offsets, self.compressed_data_lengths, cache_size)
+
+    @property
+    def items(self):
+        '''all items, decoded on first access'''
+        if self._items is None:
+            starts = self.item_offsets // 4
+            types_and_ids = self.item_area[starts].tolist()
+            lengths = (self.item_area[starts+1] // 4).tolist()
+            self._items = [make_item(x & 0xffff, (x >> 16) & 0xffff, self.item_area[s+2:s+2+l]) for x, s, l in zip(types_and_ids, starts.tolist(), lengths)]
+        return self._items
+
+    def items_of_type(self, cls):
+        '''all items that are views of class `cls`, e.g. `ImageItem` or `TilemapLayerItem`'''
+        return [x for x in self.items if isinstance(x, cls)]
+
+    def get_tilemap(self, layer):
+        '''tiles of a tilemap layer as read-only (height, width, 4) uint8 view over its decompressed data'''
+        return np.frombuffer(self.data[layer.data_index], np.uint8).reshape(layer.height, layer.width, 4)
+
+    def raw_data(self, index):
+        '''compressed bytes of data block `index` as a view over the mapped file'''
+        return self.data.raw(index)
+
+    def close(self):
+        '''close the mapping, raise `BufferError` if views from `raw_data` are still in use'''
+        self._items = None
+        self.item_area = None
+        self.data.clear()
+        try:
+            self._buffer.close()
+        except BufferError:
+            raise BufferError('views of the map file from `raw_data` are still in use, release them before closing') from None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read(filename, verbose=False):
+    '''read items and data of a map, data blocks are decompressed when indexed
+
+    the compressed data is copied out of the file, which is closed before returning
+    '''
+    with MapFile(filename) as m:
+        version, size, swaplen, num_itemtypes, num_items, num_rawdata, item_area_size, data_area_size = m.header.tolist()
+        if verbose: print(f'header: {version = }, {size = }, {swaplen = }, {num_itemtypes = }, {num_items = }, {num_rawdata = }, {item_area_size = }, {data_area_size = }')
+
+        # read items info
+        itemtypes = [tuple(x) for x in m.itemtypes.tolist()]  # (type, start, count)
+        if verbose: print(f'{itemtypes = }')
 
         # read items
-        items = [Item(f) for i in range(num_items)]
+        items = m.items
 
-        # read compressed data
-        data = [zlib.decompress(f.read(l)) for l in compressed_data_lengths]
+        # lazily decompressed data, from a copy of the compressed data area so the file can be closed
+        data_area = m._buffer[m.data_area_start:m.data_area_start+data_area_size]
+        data = DataBlocks(data_area, 0, m.compressed_data_offsets, m.compressed_data_lengths, m.data.cache_size)
 
         # print info
         if verbose:
@@ -149,13 +300,15 @@ def read(filename, verbose=False):
                 print(f'{len([x for x in items if x.type == i]):4d} {typename}')
             print('items:')
             for item in items:
-                print(f'{item.id:3d} {item.type}: {item.data}')
-            print(f'data ({data_area_size} / {sum(uncompressed_data_lengths)}):')
+                print(f'{item.id:3d} {item.type}: {item.data.tolist()}')
+            # version 3 maps have no uncompressed lengths
+            uncompressed_size = int(m.uncompressed_data_lengths.sum()) if m.uncompressed_data_lengths is not None else sum(len(x) for x in data)
+            print(f'data ({data_area_size} / {uncompressed_size}):')
             for x in data:
                 print(f'{len(x):3d} - {x[:30]} ...')
 
-        # done
-        return items, data
+    # done
+    return items, data
 
 
 
@@ -0,0 +1,218 @@
+'''local http service generating maps on a pool of warm worker processes
+
+    GET  /maps/<generator>?seed=1&basesize=300&valid=100   -> map file bytes
+    POST /maps/<generator>  with a json object of parameters (including seed and valid)
+    GET  /status                                            -> json with workers, running and waiting requests
+
+parameter values are read as json if possible (numbers, lists, ...). `valid` only returns maps whose finish can be reached,
+the seed of the returned map is in the `X-Map-Seed` header. with a cache directory, maps with a seed are only generated once
+'''
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from generators import GENERATORS, generate, generate_valid
+from map_cache import MapCache
+
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+def warm_up():
+    '''generate a tiny map, so imports and first-call setup are done before the first request
+
+    runs as initializer of every worker process, before it takes its first job
+    '''
+    generate_map('random_blocks', {'seed': 0})
+
+
+def generate_map(generator, params, cache=None):
+    '''generate a map in a worker process, return its bytes and the seed it was generated with
+
+    `cache` is `(directory, max_bytes)` of a `MapCache` to store the map in
+    '''
+    params = dict(params)
+    seed = params.pop('seed', None)
+    attempts = params.pop('valid', 0)
+    if cache:
+        data, info = MapCache(*cache).generate(generator, seed, attempts, **params)
+        return data, info['seed']
+    buffer = io.BytesIO()
+    if attempts:
+        seed, _ = generate_valid(generator, buffer, seed, attempts, **params)
+    else:
+        generate(generator, buffer, seed, **params)
+    return buffer.getvalue(), seed  # pickled back to the server process by the pool
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+class MapService:
+    '''generates maps for http requests on `workers` processes
+
+    at most `workers` maps are generated at once, up to `max_waiting` further requests wait for a worker
+    and any more are answered with 503 right away, so clients notice overload instead of piling up
+    '''
+    def __init__(self, workers=None, max_waiting=16, timeout=120, cache=None, cache_size=1024**3):
+        self.workers = workers or os.cpu_count()
+        self.cache = MapCache(cache, cache_size) if cache else None
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.executor = ProcessPoolExecutor(self.workers, initializer=warm_up)
+        self.slots = None
+        self.waiting = 0
+        self.running = 0
+        self.served = 0
+        self.overdue = set()  # jobs that timed out but still keep their worker busy
+
+    async def start(self):
+        '''start the worker processes, by giving each of them a job at once (they warm up before running it)'''
+        self.slots = asyncio.Semaphore(self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, os.getpid) for _ in range(self.workers)])
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        '''answer one http request per connection'''
+        try:
+            try:
+                status, headers, body = await self.respond(reader)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                status, headers, body = 400, {'Content-Type': 'text/plain'}, f'{e}\n'.encode()
+            except Exception as e:
+                status, headers, body = 500, {'Content-Type': 'text/plain'}, f'{type(e).__name__}: {e}\n'.encode()
+            head = f'HTTP/1.1 {status} {REASONS[status]}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+            writer.write(f'{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode())
+            writer.write(body)  # separately, instead of copying the map into one buffer with the head
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        '''read a request and return (status, headers, body)'''
+        method, target, _ = (await reader.readuntil(b'\r\n')).decode('latin-1').split(' ', 2)
+        length = 0
+        while (line := await reader.readuntil(b'\r\n')) != b'\r\n':
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        url = urlsplit(target)
+        if url.path == '/status':
+            status = {'workers': self.workers, 'running': self.running, 'waiting': self.waiting, 'served': self.served}
+            if self.cache:
+                status['cache'] = self.cache.stats()
+            return 200, {'Content-Type': 'application/json'}, json.dumps(status).encode()
+
+        # parameters from the query string or the json body
+        generator = url.path.removeprefix('/maps/')
+        if not url.path.startswith('/maps/') or generator not in GENERATORS:
+            return 404, {'Content-Type': 'text/plain'}, f'use /maps/<generator> with one of: {", ".join(GENERATORS)}\n'.encode()
+        if method == 'GET':
+            params = {name: parse_value(value) for name, value in parse_qsl(url.query)}
+        elif method == 'POST':
+            params = json.loads(await reader.readexactly(length) or b'{}')
+            if not isinstance(params, dict):
+                raise ValueError('the body has to be a json object of parameters')
+        else:
+            return 405, {'Content-Type': 'text/plain'}, b'use GET or POST\n'
+        return await self.generate(generator, params)
+
+    async def generate(self, generator, params):
+        '''answer from the cache or generate a map on a free worker, waiting for one if there is room in the queue'''
+        cache = None
+        if self.cache:
+            cache = (self.cache.directory, self.cache.max_bytes)
+            key = self.cache.key(generator, params.get('seed'), {k: v for k, v in params.items() if k not in ('seed', 'valid')}, params.get('valid', 0))
+            cached = key and await asyncio.to_thread(self.cache.get, key)
+            if cached:
+                self.served += 1
+                data, info = cached
+                return 200, {'Content-Type': 'application/octet-stream', 'X-Map-Seed': json.dumps(info['seed']), 'X-Cache': 'hit'}, data
+        if self.waiting >= self.max_waiting:
+            return 503, {'Content-Type': 'text/plain', 'Retry-After': '1'}, b'too many requests waiting\n'
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        release = True
+        try:
+            start = time.perf_counter()
+            job = asyncio.get_running_loop().run_in_executor(self.executor, generate_map, generator, params, cache)
+            try:
+                data, seed = await asyncio.wait_for(asyncio.shield(job), self.timeout)
+            except asyncio.TimeoutError:
+                # the worker can't be interrupted, keep its slot until it is done
+                release = False
+                task = asyncio.create_task(self.release_when_done(job))
+                self.overdue.add(task)
+                task.add_done_callback(self.overdue.discard)
+                return 504, {'Content-Type': 'text/plain'}, f'generation took longer than {self.timeout}s\n'.encode()
+            except (ValueError, TypeError) as e:
+                return 400, {'Content-Type': 'text/plain'}, f'{e}\n'.encode()
+            except Exception as e:
+                return 500, {'Content-Type': 'text/plain'}, f'{type(e).__name__}: {e}\n'.encode()
+            self.served += 1
+            headers = {'Content-Type': 'application/octet-stream', 'X-Map-Seed': json.dumps(seed), 'X-Generation-Time': f'{time.perf_counter() - start:.3f}'}
+            return 200, headers, data
+        finally:
+            if release:
+                self.running -= 1
+                self.slots.release()
+
+    async def release_when_done(self, job):
+        try:
+            await job
+        except Exception:
+            pass
+        self.running -= 1
+        self.slots.release()
+
+
+async def serve(host='127.0.0.1', port=8303, unix=None, workers=None, max_waiting=16, timeout=120, cache=None, cache_size=1024**3):
+    service = MapService(workers, max_waiting, timeout, cache, cache_size)
+    try:
+        await service.start()
+        if unix:
+            server = await asyncio.start_unix_server(service.handle, unix)
+        else:
+            server = await asyncio.start_server(service.handle, host, port)
+        print(f'serving maps on {unix or f"http://{host}:{port}"} with {service.workers} workers')
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='serve generated maps over http', formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8303)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a unix socket instead of a tcp port')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    parser.add_argument('--max-waiting', type=int, default=16, help='requests waiting for a worker before new ones get 503')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds before a request gets 504')
+    parser.add_argument('--cache', metavar='DIR', help='keep generated maps in DIR and answer repeated requests from there')
+    parser.add_argument('--cache-size', type=int, default=1024, help='MiB of maps to keep in the cache')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers, args.max_waiting, args.timeout, args.cache, args.cache_size * 2**20))
+    except KeyboardInterrupt:
+        pass
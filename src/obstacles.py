@@ -0,0 +1,41 @@
+'''grow obstacles as random walks, all steps of all walks at once'''
+
+import numpy as np
+from random_streams import step_array
+
+
+
+ROTATIONS = np.array([(0,-1),(-1,0),(0,1),(1,0)])  # same order as the rotations of the generators
+
+
+def grow_obstacles(rng, start, grow_direction, growlen, count, direction_change_probability, chunk=None):
+    '''grow `count` obstacles from `start` and return the (n, 2) positions of all their tiles
+
+    each obstacle is a walk starting in rotation `grow_direction`, turning left or right with `direction_change_probability` per step.
+    a walk stops when it is `growlen` away from `start` or when its next step would go behind `start` (into the wall).
+    steps are drawn `chunk` at a time for all walks, walks that didn't stop within a chunk go on with the next one.
+    '''
+    chunk = chunk or 4 * growlen
+    start = np.asarray(start)
+    initial_grow_dir = ROTATIONS[grow_direction % 4]
+    directions = np.full(count, grow_direction)  # current grow direction of each walk
+    positions = np.tile(start + initial_grow_dir, (count, 1))  # current position of each walk
+    tiles = []
+    while len(directions):
+        # directions and positions of the next `chunk` steps of each walk
+        changes = step_array(rng, direction_change_probability, (len(directions), chunk))
+        walk_directions = directions[:,None] + np.cumsum(changes, axis=1) - changes
+        steps = ROTATIONS[walk_directions % 4]
+        walk = positions[:,None] + np.cumsum(steps, axis=1) - steps[:,:1]
+
+        # stop when going too far or when hitting a wall
+        offsets = walk - start
+        going = ((offsets**2).sum(axis=2) < growlen**2) & ((offsets + steps) * initial_grow_dir >= 0).all(axis=2)
+        lengths = np.where(going.all(axis=1), chunk, going.argmin(axis=1))
+        tiles.append(walk[np.arange(chunk) < lengths[:,None]])
+
+        # continue the walks that didn't stop
+        unfinished = lengths == chunk
+        directions = walk_directions[unfinished,-1] + changes[unfinished,-1]
+        positions = walk[unfinished,-1] + ROTATIONS[directions % 4]
+    return np.concatenate(tiles)
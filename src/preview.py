@@ -0,0 +1,119 @@
+'''preview images and png thumbnails of a game layer'''
+
+import argparse
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from map_reader import MapFile, TilemapLayerItem
+
+
+
+# game tile -> rgb color, tiles not listed are drawn like blocks
+GAME_COLORS = np.full((256, 3), (90, 90, 90), dtype=np.uint8)
+GAME_COLORS[0] = (180, 210, 240)  # air
+GAME_COLORS[1] = (60, 60, 60)  # blocks
+GAME_COLORS[3] = (150, 120, 90)  # unhookable
+GAME_COLORS[9] = (80, 110, 200)  # freeze
+GAME_COLORS[33] = (60, 200, 60)  # start line
+GAME_COLORS[34] = (220, 60, 60)  # finish line
+GAME_COLORS[192] = (250, 200, 0)  # spawn
+
+
+def downsample(game, max_size=256):
+    '''return every n-th tile of the 2d `game` plane in both directions, so that no side is longer than `max_size`'''
+    step = max(1, -(-max(game.shape) // max_size))
+    return game[::step, ::step]
+
+
+def colorize(game):
+    '''map the tiles of a 2d `game` plane to a (height, width, 3) rgb image'''
+    return GAME_COLORS[game]
+
+
+def to_ppm(image):
+    '''encode a (height, width, 3) rgb image as binary ppm, which tk can show without extra libraries'''
+    return b'P6 %d %d 255\n' % (image.shape[1], image.shape[0]) + np.ascontiguousarray(image).tobytes()
+
+
+def pool(game, factor, mode='max'):
+    '''downsample the 2d `game` plane by an integer `factor`, each block of factor x factor tiles becomes one tile
+
+    `mode` is 'max' (highest tile id, so spawn, start/finish and freeze stay visible) or 'mode' (most common tile).
+    the last blocks are filled up with the edge tiles if the size isn't a multiple of `factor`
+    '''
+    if factor == 1:
+        return game
+    height, width = -(-game.shape[0] // factor), -(-game.shape[1] // factor)
+    if game.shape != (height * factor, width * factor):
+        game = np.pad(game, ((0, height * factor - game.shape[0]), (0, width * factor - game.shape[1])), mode='edge')
+    blocks = game.reshape(height, factor, width, factor)
+    if mode == 'max':
+        return blocks.max(axis=(1, 3))
+    if mode == 'mode':
+        # count each tile that occurs per block, ties go to the lower tile id
+        tiles = np.unique(game)
+        counts = np.stack([(blocks == tile).sum(axis=(1, 3), dtype=np.int32) for tile in tiles])
+        return tiles[counts.argmax(axis=0)]
+    raise ValueError(f'unknown pooling mode {mode!r}, choose one of: max, mode')
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def to_png(game, palette=GAME_COLORS):
+    '''encode the 2d `game` plane as 8 bit palette png, the tile ids are the palette indices, so coloring costs nothing'''
+    height, width = game.shape
+    rows = np.zeros((height, width + 1), dtype=np.uint8)  # every row starts with filter type 0 (none)
+    rows[:,1:] = game
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)),
+        _png_chunk(b'PLTE', np.ascontiguousarray(palette, dtype=np.uint8).tobytes()),
+        _png_chunk(b'IDAT', zlib.compress(rows.tobytes())),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def read_game(filename):
+    '''read the 2d game plane of a map file'''
+    with MapFile(filename) as m:
+        for layer in m.items_of_type(TilemapLayerItem):
+            if layer.is_game:
+                return m.get_tilemap(layer)[:,:,0].copy()
+    raise ValueError(f'{filename} has no game layer')
+
+
+def save_thumbnail(game, filename, factor=1, mode='max', max_size=None):
+    '''save the 2d `game` plane as png, downsampled by `factor` or by the smallest factor that fits into `max_size`'''
+    if max_size:
+        factor = max(factor, -(-max(game.shape) // max_size))
+    with open(filename, 'wb') as f:
+        f.write(to_png(pool(game, factor, mode)))
+
+
+def render_map(task):
+    '''save a png thumbnail for a map file, `task` is (map filename, png filename, factor, mode, max_size)'''
+    mapfile, pngfile, factor, mode, max_size = task
+    save_thumbnail(read_game(mapfile), pngfile, factor, mode, max_size)
+    return pngfile
+
+
+
+# render maps when the script is called from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='render png thumbnails of the game layer of maps')
+    parser.add_argument('maps', nargs='+')
+    parser.add_argument('-o', '--output', default='.', help='directory for the pngs, named like the maps')
+    parser.add_argument('-f', '--factor', type=int, default=1, help='downsampling factor')
+    parser.add_argument('-s', '--max-size', type=int, default=None, help='downsample further until no side is longer than this')
+    parser.add_argument('--mode', choices=['max', 'mode'], default='max', help='pooling of downsampled blocks')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    args = parser.parse_args()
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    tasks = [(x, str(Path(args.output) / (Path(x).stem + '.png')), args.factor, args.mode, args.max_size) for x in args.maps]
+    with ProcessPoolExecutor(args.workers) as executor:
+        for pngfile in executor.map(render_map, tasks, chunksize=16):
+            print(pngfile)
@@ -0,0 +1,95 @@
+'''named stage timers and counters for map generation, disabled by default'''
+
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+
+def _no_lap(name):
+    pass
+
+
+class Profiler:
+    '''collects time per stage and counters, all methods are (nearly) free while disabled'''
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)  # stage -> seconds
+        self.calls = defaultdict(int)  # stage -> number of times it was timed
+        self.counters = defaultdict(int)
+
+    def add_time(self, name, seconds):
+        self.times[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, name, n=1):
+        '''add `n` to counter `name`'''
+        if self.enabled:
+            self.counters[name] += n
+
+    def stage(self, name):
+        '''context manager timing the block as stage `name`'''
+        return self._stage(name) if self.enabled else nullcontext()
+
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def laps(self):
+        '''return a function `lap(name)` that adds the time since the previous lap to stage `name`
+
+        this times consecutive phases of a function without wrapping each one in a `with` block
+        '''
+        if not self.enabled:
+            return _no_lap
+        last = time.perf_counter()
+        def lap(name):
+            nonlocal last
+            now = time.perf_counter()
+            self.add_time(name, now - last)
+            last = now
+        return lap
+
+    def report(self):
+        return {
+            'stages': {name: {'time': self.times[name], 'calls': self.calls[name]} for name in self.times},
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, report):
+        '''add the stages and counters of a report, e.g. from another process'''
+        for name, stage in report['stages'].items():
+            self.times[name] += stage['time']
+            self.calls[name] += stage['calls']
+        for name, n in report['counters'].items():
+            self.counters[name] += n
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+profiler = Profiler()
+
+
+@contextmanager
+def profile_to(filename):
+    '''enable the profiler within the block and save its report to `filename`, do nothing if `filename` is None'''
+    if filename is None:
+        yield
+        return
+    profiler.reset()
+    profiler.enabled = True
+    try:
+        yield
+    finally:
+        profiler.enabled = False
+        profiler.save(filename)
@@ -0,0 +1,17 @@
+'''pre-drawn random numbers for the map generators'''
+
+import numpy as np
+from profiling import profiler
+
+
+
+def step_array(rng, p, size):
+    '''draw an int8 array of random steps, -1 and 1 with probability p/2 each and 0 otherwise'''
+    u = rng.random(size)
+    profiler.count('rng_draws', u.size)
+    return (u >= 1 - p/2).astype(np.int8) - (u < p/2)
+
+
+def random_steps(rng, p, size):
+    '''draw `size` random steps like `step_array` as list'''
+    return step_array(rng, p, size).tolist()
@@ -0,0 +1,76 @@
+'''check that the finish of a map can be reached from the spawn, with a flood fill over the game layer'''
+
+import numpy as np
+
+
+
+BLOCKING_TILES = (1, 2, 3)  # solid, death, unhookable (freeze can be passed)
+PASSABLE = np.ones(256, dtype=bool)  # game tile -> whether a tee can move through it
+PASSABLE[list(BLOCKING_TILES)] = False
+
+SPAWN = 192
+FINISH = 34
+
+
+class UnreachableError(ValueError):
+    '''raised by the generators when a map can't be finished'''
+
+
+def run_labels(passable):
+    '''label the connected regions of a 2d boolean `passable` mask (4-neighbourhood), 0 for tiles that aren't passable
+
+    every horizontal run of passable tiles is one node, runs touching vertically are joined with a vectorized union find
+    (hook the larger root onto the smaller one, then jump pointers until all trees are flat), so the work doesn't grow with path length
+    '''
+    # number the horizontal runs, 1, 2, ...
+    run_starts = passable.copy()
+    run_starts[:,1:] &= ~passable[:,:-1]
+    runs = np.cumsum(run_starts.ravel(), dtype=np.int32).reshape(passable.shape)
+    runs[~passable] = 0
+    # runs above each other are connected, one edge where each overlap starts
+    touching = passable[:-1] & passable[1:]
+    overlap_starts = touching.copy()
+    overlap_starts[:,1:] &= ~touching[:,:-1]
+    a, b = runs[:-1][overlap_starts], runs[1:][overlap_starts]
+    labels = np.arange(runs.max() + 1, dtype=np.int32)
+    while True:
+        la, lb = labels[a], labels[b]
+        differ = la != lb
+        if not differ.any():
+            break
+        np.minimum.at(labels, np.maximum(la, lb)[differ], np.minimum(la, lb)[differ])
+        while True:
+            jumped = labels[labels]
+            if (jumped == labels).all():
+                break
+            labels = jumped
+    return labels[runs]
+
+
+def connected(passable, starts, targets):
+    '''whether any of the `starts` tiles reaches any of the `targets` tiles through `passable` tiles (2d boolean masks)'''
+    labels = run_labels(passable)
+    reached = np.intersect1d(labels[starts], labels[targets])
+    return bool(reached.size and reached.max() > 0)
+
+
+def passes(game, start, end, radius, margin):
+    '''whether a free tile within `radius` of `start` reaches a free tile within `radius` of `end`
+
+    only the window around both points, grown by `margin`, is searched
+    '''
+    lower = np.maximum(np.minimum(start, end) - margin, 0)
+    upper = np.maximum(start, end) + margin + 1
+    window = game[lower[0]:upper[0],lower[1]:upper[1]]
+    starts = np.zeros(window.shape, dtype=bool)
+    targets = np.zeros(window.shape, dtype=bool)
+    (xa, ya), (xb, yb) = np.maximum(start - lower - radius, 0), start - lower + radius + 1
+    starts[xa:xb,ya:yb] = True
+    (xa, ya), (xb, yb) = np.maximum(end - lower - radius, 0), end - lower + radius + 1
+    targets[xa:xb,ya:yb] = True
+    return connected(PASSABLE[window], starts, targets)
+
+
+def is_finishable(game):
+    '''whether a finish tile can be reached from a spawn tile of the 2d `game` plane'''
+    return connected(PASSABLE[game], game == SPAWN, game == FINISH)
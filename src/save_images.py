@@ -1,30 +1,83 @@
-'''save images embedded in a map file'''
+'''save images embedded in map files'''
 
-import sys
-from map_reader import read
-from PIL import Image
+import argparse
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from map_reader import MapFile, ImageItem
+from PIL import Image
+
 
 
-def save_images(filename):
-    items, data = read(filename)
+def save_image(mapfile, item, filename):
+    '''decompress the data of an embedded image and save it as png (zlib and png encoding release the GIL, so images can be saved on threads)'''
+    data = zlib.decompress(mapfile.raw_data(item.data_index))
+    Image.frombuffer('RGBA', (item.width, item.height), data, 'raw', 'RGBA', 0, 1).save(filename)
+    return filename
 
-    # save images
-    for item in items:
-        if item.type == 2:  # image
-            version, width, height, external, name_index, data_index = item.data
-            name = data[name_index][:-1].decode("utf-8")
-            if external == 0:
+
+def save_images(filename, output='.', workers=None, prefix=None):
+    '''save the embedded images of a map to `output` on `workers` threads, only image names and data are decompressed
+
+    the images are named `<prefix>_<image name>.png`, the prefix defaults to the name of the map
+    '''
+    prefix = prefix or Path(filename).stem
+    Path(output).mkdir(parents=True, exist_ok=True)
+    saved = []
+    with MapFile(filename) as m:
+        jobs = []
+        for item in m.items_of_type(ImageItem):
+            name = m.data[item.name_index][:-1].decode('utf-8')
+            if item.external == 0:
                 print(f'saving {name}')
-                img = Image.frombytes('RGBA', (width, height), data[data_index], 'raw')
-                with open(Path(filename).stem + '_' + name + '.png', 'wb') as f:
-                    img.save(f)
+                jobs.append((item, Path(output) / f'{prefix}_{name}.png'))
             else:
                 print(f'skipping {name} (external)')
+        with ThreadPoolExecutor(workers or min(len(jobs), os.cpu_count()) or 1) as executor:
+            saved = list(executor.map(lambda job: save_image(m, *job), jobs))
+    return saved
+
+
+def save_images_task(task):
+    filename, output, prefix = task
+    return save_images(filename, output, workers=1, prefix=prefix)
+
+
+def map_files(paths):
+    '''the given map files, and all maps in the given directories (recursively), with their subdirectory in that directory'''
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from ((x, x.parent.relative_to(path)) for x in sorted(path.rglob('*.map')))
+        else:
+            yield path, Path()
+
+
+def save_all_images(paths, output='.', workers=None):
+    '''save the embedded images of many maps, spread over `workers` processes, return the number of saved images
+
+    the images of maps in subdirectories are saved to the same subdirectories of `output`,
+    maps that would still get the same names (e.g. from two given directories) are numbered
+    '''
+    tasks, used = [], set()
+    for filename, subdirectory in map_files(paths):
+        directory, prefix, n = Path(output) / subdirectory, filename.stem, 1
+        while (directory, prefix) in used:
+            n += 1
+            prefix = f'{filename.stem}_{n}'
+        used.add((directory, prefix))
+        tasks.append((filename, directory, prefix))
+    if len(tasks) == 1:
+        filename, directory, prefix = tasks[0]
+        return len(save_images(filename, directory, workers, prefix))
+    with ProcessPoolExecutor(workers) as executor:
+        return sum(len(x) for x in executor.map(save_images_task, tasks, chunksize=4))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print('Usage: python save_images.py FILENAME')
-        exit()
-    save_images(sys.argv[1])
+    parser = argparse.ArgumentParser(description='save the images embedded in maps as png')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='map files or directories with maps')
+    parser.add_argument('-o', '--output', default='.', help='directory to save the images to')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (threads for a single map), default: number of cpus')
+    args = parser.parse_args()
+    print(f'saved {save_all_images(args.paths, args.output, args.workers)} images')
@@ -0,0 +1,65 @@
+'''turn game layer tiles into the tiles of visual layers with lookup tables'''
+
+import numpy as np
+from map_creator import TilePlane
+from profiling import profiler
+
+
+
+# game tile -> tile of the tileset, or a list of tiles (or (tile, weight) pairs) to pick from at random
+TILESETS = {
+    'generic_unhookable': {
+        3: 8,  # unhookable walls
+    },
+    'desert_main': {
+        1: [7, 64, 65, 70],  # walls and obstacles
+        9: 126,  # freeze
+        33: 94,  # start line
+        34: 94,  # finish line
+    },
+    'grass_main': {
+        1: 16,  # walls and obstacles
+    },
+}
+
+
+class TileMapping:
+    '''lookup table from game tiles to the tiles of a tileset
+
+    every game tile has a row of 256 slots, random variants fill the slots according to their weights,
+    so one random byte per tile selects the variant
+    '''
+    def __init__(self, mapping):
+        self.lut = np.zeros((256, 256), dtype=np.uint8)
+        self.random = False
+        for game_tile, tiles in mapping.items():
+            if not isinstance(tiles, (list, tuple)):
+                self.lut[game_tile] = tiles
+                continue
+            tiles, weights = zip(*(x if isinstance(x, tuple) else (x, 1) for x in tiles))
+            ends = np.rint(np.cumsum(weights) / sum(weights) * 256).astype(int)
+            for tile, start, end in zip(tiles, [0, *ends[:-1]], ends):
+                self.lut[game_tile, start:end] = tile
+            self.random |= len(set(tiles)) > 1
+
+    def apply(self, game, rng=None):
+        '''return the tiles for the 2d `game` plane, in one lookup pass'''
+        if not self.random:
+            return self.lut[:,0][game]
+        rng = rng or np.random.default_rng()
+        profiler.count('rng_draws', game.size)
+        return self.lut[game, rng.integers(0, 256, game.shape, dtype=np.uint8)]
+
+
+def tile_layers(game, tilesets, rng=None):
+    '''create a visual layer for each `(imagename, mapping)` in `tilesets` from the 2d `game` plane
+
+    the layers are `TilePlane`s mapping the game tiles only chunk by chunk while the map is written,
+    random mappings get their own generator (seeded from `rng`) so the result doesn't depend on the order layers are compressed in
+    '''
+    layers = []
+    for imagename, mapping in tilesets:
+        layer_rng = np.random.default_rng(rng.integers(2**63)) if rng is not None and mapping.random else rng
+        convert_key = None if mapping.random else mapping.lut[:,0].tobytes()  # fixed mappings give the same tiles for the same game
+        layers.append((imagename, TilePlane(game, lambda rows, mapping=mapping, layer_rng=layer_rng: mapping.apply(rows, layer_rng), convert_key)))
+    return layers
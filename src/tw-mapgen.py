@@ -1,7 +1,10 @@
 '''gui to create a layered map'''
 
+import queue
+import threading
 import tkinter as tk
-from create_layered import create_layered
+from create_layered import create_layered, LayoutCache
+from preview import downsample, colorize, to_ppm
 from pathlib import Path
 
 
@@ -22,8 +25,10 @@ config = [
     ('block corner (game layer)', '1', int),
     ('block obstacle (game layer)', '1', int),
     ('block freeze (game layer)', '9', int),
-    ('directions (0:left, 1:up, 2:right, 3:down)', '2,2,2,3,3,3,2,1,1,1,2,2,3,3,3,2,1,1,1,2,2,2,2', lambda x: list(map(int,x.split(',')) if x.strip() else None))  # directions to build along
+    ('directions (0:left, 1:up, 2:right, 3:down)', '2,2,2,3,3,3,2,1,1,1,2,2,3,3,3,2,1,1,1,2,2,2,2', lambda x: list(map(int,x.split(',')) if x.strip() else None)),  # directions to build along
+    ('seed (empty: random)', '', lambda x: int(x) if x.strip() else None),
 ]
+checkpoints = LayoutCache()  # only the parts after a changed direction are rebuilt
 
 
 # window
@@ -48,20 +53,74 @@ frame.columnconfigure(0,weight=0)
 frame.columnconfigure(1,weight=1)
 frame.pack(fill=tk.BOTH, expand=True)
 
-# generate
-status_label = None
-def generate(*args):
+# generate in a background thread, the worker only hands progress and previews to the tk thread through a queue
+class Cancelled(Exception):
+    pass
+
+updates = queue.Queue()
+cancel_event = threading.Event()
+
+def worker(params, total):
+    def progress(parts_done, game):
+        if cancel_event.is_set():
+            raise Cancelled()
+        updates.put(('progress', f'part {parts_done}{f"/{total}" if total else ""} done', downsample(game).copy()))
     try:
-        create_layered(*[t(x.get()) for x, (text, default, t) in zip(entries, config)])
-        result = 'success!'
+        create_layered(*params, checkpoints=checkpoints, progress=progress)
+        updates.put(('done', 'success!', None))
+    except Cancelled:
+        updates.put(('done', 'cancelled', None))
     except Exception as e:
-        result = f'error: {e}'
-    print(result)
-    status_label['text'] = result
-button = tk.Button(text="generate", command=generate)
-button.pack()
+        updates.put(('done', f'error: {e}', None))
+
+def generate(*args):
+    try:
+        params = [t(x.get()) for x, (text, default, t) in zip(entries, config)]
+    except ValueError as e:
+        status_label['text'] = f'error: {e}'
+        return
+    directions = params[-2]
+    cancel_event.clear()
+    generate_button['state'] = tk.DISABLED
+    cancel_button['state'] = tk.NORMAL
+    status_label['text'] = 'generating...'
+    threading.Thread(target=worker, args=(params, directions and len(directions) - 1), daemon=True).start()
+    window.after(50, poll)
+
+def cancel(*args):
+    cancel_event.set()
+    status_label['text'] = 'cancelling...'
+
+def poll():
+    '''show the latest progress and preview, keep polling until the worker is done'''
+    done = False
+    preview = None
+    while not updates.empty():
+        kind, text, image = updates.get()
+        done |= kind == 'done'
+        preview = image if image is not None else preview
+        if not cancel_event.is_set() or done:
+            status_label['text'] = text
+    if preview is not None:
+        preview_label.image = tk.PhotoImage(data=to_ppm(colorize(preview)), format='PPM')  # keep a reference, tk doesn't
+        preview_label['image'] = preview_label.image
+    if done:
+        print(status_label['text'])
+        generate_button['state'] = tk.NORMAL
+        cancel_button['state'] = tk.DISABLED
+    else:
+        window.after(50, poll)
+
+buttons = tk.Frame()
+generate_button = tk.Button(text="generate", command=generate, master=buttons)
+generate_button.pack(side=tk.LEFT)
+cancel_button = tk.Button(text="cancel", command=cancel, state=tk.DISABLED, master=buttons)
+cancel_button.pack(side=tk.LEFT)
+buttons.pack()
 status_label = tk.Label()
 status_label.pack()
+preview_label = tk.Label()
+preview_label.pack()
 
 
 # mainloop